@@ -1,3 +1,5 @@
+import functools
+import threading
 import time
 import traceback
 
@@ -8,18 +10,93 @@ from PIL import Image
 from PIL import ImageTk
 import tkinter as tk
 
-from utils import log_write, get_bb_for_obtain_image, get_bit_width, required_bit_depth, get_num_bit_shift
+from utils import log_write, get_bb_for_obtain_image, get_bit_width, required_bit_depth, get_preview_lut, \
+    get_gendc_image_offset, get_color_lut, ParamStore, MIN_PREVIEW_RATE
 from utils import DEFAULT_PREFIX_NAME1, DEFAULT_PREFIX_NAME0, DEFAULT_GENDC_PREFIX_NAME0, DEFAULT_GENDC_PREFIX_NAME1
 
-import queue
-
-q = queue.Queue()
-
-MAX_BUF_SIZE = 50
-
-
-def clear_queue():
-    q.queue.clear()
+RING_CAPACITY = 4
+PREVIEW_BUFFERS = 3  # previews per device: one being painted by Tk, one published for it, one being written
+
+
+# acquisition pipelines
+PREVIEW_MODE = "preview"
+IMAGE_RECORD_MODE = "image-record"
+GENDC_RECORD_MODE = "gendc-record"
+
+
+class FrameSlot:
+    def __init__(self, num_device, height, width, data_type, payloadsizes):
+        self.seq = -1  # -1 while the producer is writing into the slot
+        self.is_gendc = False
+        self.images = [np.full((height, width), fill_value=0, dtype=data_type) for _ in range(num_device)]
+        self.gendc = [np.full((payloadsizes[i],), fill_value=0, dtype=np.uint8) for i in range(num_device)]
+
+
+class FrameRing:
+    # latest frame wins: the producer never waits, the oldest slot is overwritten
+    def __init__(self, capacity=RING_CAPACITY):
+        self.capacity = capacity
+        self.slots = []
+        self.write_seq = 0  # sequence number of the next published frame
+        # drop counters
+        self.skipped = 0  # never looked at by a latest-frame consumer
+        self.torn = 0  # read while the producer was reusing the slot, discarded
+        self.closed = False
+        self.cond = threading.Condition()
+
+    def allocate(self, num_device, height, width, data_type, payloadsizes):
+        self.slots = [FrameSlot(num_device, height, width, data_type, payloadsizes) for _ in range(self.capacity)]
+        self.write_seq = 0
+        self.skipped = 0
+        self.torn = 0
+        self.closed = False
+
+    def put(self, outputs_data, is_gendc):
+        seq = self.write_seq
+        slot = self.slots[seq % self.capacity]
+        slot.seq = -1
+        dst = slot.gendc if is_gendc else slot.images
+        for i in range(len(outputs_data)):
+            np.copyto(dst[i], outputs_data[i])
+        slot.is_gendc = is_gendc
+        slot.seq = seq
+        self.write_seq = seq + 1
+        with self.cond:
+            self.cond.notify_all()
+
+    def latest(self, last_seq):
+        # newest published frame, or None if nothing newer than last_seq
+        seq = self.write_seq - 1
+        if seq <= last_seq:
+            return last_seq, None
+        if last_seq >= 0:
+            self.skipped += seq - last_seq - 1
+        return seq, self.slots[seq % self.capacity]
+
+    def wait(self, last_seq, timeout):
+        # block until a frame newer than last_seq is published, the ring is closed or timeout elapses
+        with self.cond:
+            return self.cond.wait_for(lambda: self.write_seq - 1 > last_seq or self.closed, timeout)
+
+    def is_intact(self, seq, slot):
+        # check after reading: the producer may have wrapped around onto this slot
+        if slot.seq == seq:
+            return True
+        self.torn += 1
+        return False
+
+    def flush(self):
+        # sequence number of the newest published frame, older frames are not shown any more
+        with self.cond:
+            self.cond.notify_all()
+        return self.write_seq - 1
+
+    def close(self):
+        self.closed = True
+        self.flush()
+
+
+frame_ring = FrameRing()
 
 
 class FrameCapture:
@@ -29,8 +106,8 @@ class FrameCapture:
         self.sim_mode = False
         self.is_sync = False
         self.is_realtime = True
-        self.gains = dev_info[dev_info["Gain Key"]]
-        self.exposuretimes = dev_info[dev_info["ExposureTime Key"]]
+        self.gains = ParamStore(dev_info[dev_info["Gain Key"]])
+        self.exposuretimes = ParamStore(dev_info[dev_info["ExposureTime Key"]])
 
         if test_info["Simulation Mode"]:
             self.sim_mode = True
@@ -44,7 +121,18 @@ class FrameCapture:
         self.output_directories = [test_info["Default Directory"]] * dev_info["Number of Devices"]
 
         self.exclude = False
+        # don't spend time on preview copies while recording
+        self.drop_preview_on_record = test_info["Drop Preview While Recording"]
+
+        # (Builder, bound ports) of the running graph, the only one holding the devices
+        self.pipeline = None
+        # timing hook, called with (mode, switch latency in s)
+        self.on_switch = None
 
+    def report_switch(self, mode, latency):
+        log_write("DEBUG", "Switched to {} pipeline in {:.1f} ms".format(mode, latency * 1000))
+        if self.on_switch is not None:
+            self.on_switch(mode, latency)
 
     def run(self):
         try:
@@ -84,32 +172,9 @@ class FrameCapture:
 
             bb_name = get_bb_for_obtain_image(num_device, pixelformat)
 
-            builder = Builder()
-            builder.set_target("host")
-            builder.with_bb_module("ion-bb")
-
             # set params
             num_devices = Param("num_devices", str(num_device))
 
-            if self.sim_mode:
-                node = builder.add(bb_name).set_params([num_devices,
-                                                        Param("pixel_format", pixelformat),
-                                                        Param("width", width), Param("height", height),
-                                                        Param("force_sim_mode", True),
-                                                        ])
-            else:
-                # add a node to pipeline
-                node = builder.add(bb_name).set_iports([gain_ps[0], exposure_ps[0]]) \
-                    .set_params(
-                    [num_devices, frame_sync, realtime_display_mode, enable_control, gain_key,
-                     exposure_key]) if num_device == 1 \
-                    else builder.add(bb_name) \
-                    .set_iports([gain_ps[0], exposure_ps[0], gain_ps[1], exposure_ps[1]]) \
-                    .set_params(
-                    [num_devices, frame_sync, realtime_display_mode, enable_control, gain_key, exposure_key])
-
-            display_bi_p = node.get_port("output")
-
             # create halide buffer for output port
             img_outputs = []
             img_outputs_data = []
@@ -125,8 +190,6 @@ class FrameCapture:
                 img_outputs_data.append(np.full(img_output_size, fill_value=0, dtype=data_type))
                 img_outputs.append(Buffer(array=img_outputs_data[i]))
 
-            display_bi_p.bind(img_outputs)
-
             # create halide buffer for output port
             gendc_outputs = []
             gendc_outputs_data = []
@@ -140,163 +203,241 @@ class FrameCapture:
             out0 = Buffer(t, ())
             out1 = Buffer(t, ())
 
-            is_display = True
+            def add_acquisition_node(builder, name, display_mode):
+                if self.sim_mode:
+                    return builder.add(name).set_params([num_devices,
+                                                         Param("pixel_format", pixelformat),
+                                                         Param("width", width), Param("height", height),
+                                                         Param("force_sim_mode", True),
+                                                         ])
+                # add a node to pipeline
+                return builder.add(name).set_iports([gain_ps[0], exposure_ps[0]]) \
+                    .set_params(
+                    [num_devices, frame_sync, display_mode, enable_control, gain_key, exposure_key]) if num_device == 1 \
+                    else builder.add(name) \
+                    .set_iports([gain_ps[0], exposure_ps[0], gain_ps[1], exposure_ps[1]]) \
+                    .set_params(
+                    [num_devices, frame_sync, display_mode, enable_control, gain_key, exposure_key])
+
+            def build_pipeline(mode):
+                builder = Builder()
+                builder.set_target("host")
+                builder.with_bb_module("ion-bb")
+                if mode == PREVIEW_MODE:
+                    node = add_acquisition_node(builder, bb_name, realtime_display_mode)
+                    display_bi_p = node.get_port("output")
+                    display_bi_p.bind(img_outputs)
+                    ports = [display_bi_p]
+                elif mode == IMAGE_RECORD_MODE:
+                    # add 1st node to pipeline
+                    node = add_acquisition_node(builder, bb_name, Param("realtime_display_mode", False))
 
-            while not self.stop:
-                builder.run()
-                # save gendc
-                if self.start_save and self.gendc_mode:
-                    q.put((gendc_outputs_data, True))
-                # save image or previewing
-                else:
-                    q.put((img_outputs_data, False))
-
-                if self.start_save and is_display:
-                    is_display = False
-                    # clear_queue()
-                    builder = Builder()
-                    builder.set_target("host")
-                    builder.with_bb_module("ion-bb")
-                    if not self.gendc_mode:
-                        # add 1st node to pipeline
-                        if self.sim_mode:
-                            node = builder.add(bb_name).set_params([num_devices,
-                                                                    Param("pixel_format", pixelformat),
-                                                                    Param("width", width), Param("height", height),
-                                                                    Param("force_sim_mode", True),
-                                                                    ])
-                        else:
-                            node = builder.add(bb_name) \
-                                .set_iports([gain_ps[0], exposure_ps[0]]) \
-                                .set_params(
-                                [num_devices, frame_sync,
-                                 Param("realtime_display_mode", False),
-                                 enable_control, gain_key, exposure_key]) if num_device == 1 \
-                                else builder.add(bb_name) \
-                                .set_iports([gain_ps[0], exposure_ps[0], gain_ps[1], exposure_ps[1]]) \
-                                .set_params(
-                                [num_devices, frame_sync,
-                                 Param("realtime_display_mode", False),
-                                 enable_control, gain_key, exposure_key])
-
-                        device_ps = node.get_port("device_info")
-                        frame_ps = node.get_port("frame_count")
-
-                        display_bi_p = node.get_port("output")
-                        display_bi_p.bind(img_outputs)
-
-                        t_node0 = builder.add("image_io_binarysaver_u{}x2".format(depth_of_buffer)) \
-                            .set_iports([node.get_port("output")[0], device_ps[0], frame_ps[0], wp, hp, ]) \
+                    device_ps = node.get_port("device_info")
+                    frame_ps = node.get_port("frame_count")
+
+                    display_bi_p = node.get_port("output")
+                    display_bi_p.bind(img_outputs)
+
+                    t_node0 = builder.add("image_io_binarysaver_u{}x2".format(depth_of_buffer)) \
+                        .set_iports([node.get_port("output")[0], device_ps[0], frame_ps[0], wp, hp, ]) \
+                        .set_params(
+                        [Param("output_directory", self.output_directories[0]),
+                         Param("prefix", DEFAULT_PREFIX_NAME0)])
+
+                    terminator0 = t_node0.get_port("output")
+                    terminator0.bind(out0)
+                    ports = [device_ps, frame_ps, display_bi_p, terminator0]
+
+                    if num_device == 2:
+                        t_node1 = builder.add("image_io_binarysaver_u{}x2".format(depth_of_buffer)) \
+                            .set_iports([node.get_port("output")[1], device_ps[1], frame_ps[1], wp, hp, ]) \
                             .set_params(
-                            [Param("output_directory", self.output_directories[0]),
-                             Param("prefix", DEFAULT_PREFIX_NAME0)])
-
-                        terminator0 = t_node0.get_port("output")
-                        terminator0.bind(out0)
-
-                        if num_device == 2:
-                            t_node1 = builder.add("image_io_binarysaver_u{}x2".format(depth_of_buffer)) \
-                                .set_iports([node.get_port("output")[1], device_ps[1], frame_ps[1], wp, hp, ]) \
-                                .set_params(
-                                [Param("output_directory", self.output_directories[1]),
-                                 Param("prefix", DEFAULT_PREFIX_NAME1)])
-                            terminator1 = t_node1.get_port("output")
-                            terminator1.bind(out1)
-                    else:
-                        builder = Builder()
-                        builder.set_target("host")
-                        builder.with_bb_module("ion-bb")
-
-                        if self.sim_mode:
-                            node = builder.add("image_io_u3v_gendc").set_params([num_devices,
-                                                                                 Param("pixel_format", pixelformat),
-                                                                                 Param("width", width),
-                                                                                 Param("height", height),
-                                                                                 Param("force_sim_mode", True),
-                                                                                 ])
-                        else:
-                            node = builder.add("image_io_u3v_gendc").set_iports([gain_ps[0], exposure_ps[0]]) \
-                                .set_params(
-                                [num_devices, frame_sync, Param("realtime_display_mode", False), enable_control,
-                                 gain_key,
-                                 exposure_key]) if num_device == 1 \
-                                else builder.add("image_io_u3v_gendc") \
-                                .set_iports([gain_ps[0], exposure_ps[0], gain_ps[1], exposure_ps[1]]) \
-                                .set_params(
-                                [num_devices, frame_sync, Param("realtime_display_mode", False), enable_control,
-                                 gain_key,
-                                 exposure_key])
-
-                        gendc_p = node.get_port("gendc")
-                        gendc_p.bind(gendc_outputs)
-                        t_node0 = builder.add("image_io_binary_gendc_saver") \
+                            [Param("output_directory", self.output_directories[1]),
+                             Param("prefix", DEFAULT_PREFIX_NAME1)])
+                        terminator1 = t_node1.get_port("output")
+                        terminator1.bind(out1)
+                        ports.append(terminator1)
+                else:
+                    node = add_acquisition_node(builder, "image_io_u3v_gendc", Param("realtime_display_mode", False))
+
+                    gendc_p = node.get_port("gendc")
+                    gendc_p.bind(gendc_outputs)
+                    t_node0 = builder.add("image_io_binary_gendc_saver") \
+                        .set_iports(
+                        [node.get_port("gendc")[0], node.get_port("device_info")[0], payloadsize_ps[0], ]) \
+                        .set_params(
+                        [Param("output_directory", self.output_directories[0]),
+                         Param("prefix", DEFAULT_GENDC_PREFIX_NAME0)])
+                    terminator0 = t_node0.get_port("output")
+                    terminator0.bind(out0)
+                    ports = [gendc_p, terminator0]
+                    if num_device == 2:
+                        t_node1 = builder.add("image_io_binary_gendc_saver") \
                             .set_iports(
-                            [node.get_port("gendc")[0], node.get_port("device_info")[0], payloadsize_ps[0], ]) \
+                            [node.get_port("gendc")[1], node.get_port("device_info")[1], payloadsize_ps[1], ]) \
                             .set_params(
-                            [Param("output_directory", self.output_directories[0]),
-                             Param("prefix", DEFAULT_GENDC_PREFIX_NAME0)])
-                        terminator0 = t_node0.get_port("output")
-                        terminator0.bind(out0)
-                        if num_device == 2:
-                            t_node1 = builder.add("image_io_binary_gendc_saver") \
-                                .set_iports(
-                                [node.get_port("gendc")[1], node.get_port("device_info")[1], payloadsize_ps[1], ]) \
-                                .set_params(
-                                [Param("output_directory", self.output_directories[1]),
-                                 Param("prefix", DEFAULT_GENDC_PREFIX_NAME1)])
-                            terminator1 = t_node1.get_port("output")
-                            terminator1.bind(out1)
-                    builder.run()
-                    self.exclude = True
-
-                elif not self.start_save and not is_display:
-                    is_display = True
-                    # clear_queue()
-                    builder = Builder()
-                    builder.set_target("host")
-                    builder.with_bb_module("ion-bb")
-
-                    # add first node to pipeline
-                    if self.sim_mode:
-                        node = builder.add(bb_name).set_params([num_devices,
-                                                                Param("pixel_format", pixelformat),
-                                                                Param("width", width), Param("height", height),
-                                                                Param("force_sim_mode", True),
-                                                                ])
-                    else:
-                        node = builder.add(bb_name) \
-                            .set_iports([gain_ps[0], exposure_ps[0]]) \
-                            .set_params(
-                            [num_devices, frame_sync, realtime_display_mode, enable_control, gain_key,
-                             exposure_key]) if num_device == 1 \
-                            else builder.add(bb_name) \
-                            .set_iports([gain_ps[0], exposure_ps[0], gain_ps[1], exposure_ps[1]]) \
-                            .set_params(
-                            [num_devices, frame_sync, realtime_display_mode, enable_control, gain_key, exposure_key])
+                            [Param("output_directory", self.output_directories[1]),
+                             Param("prefix", DEFAULT_GENDC_PREFIX_NAME1)])
+                        terminator1 = t_node1.get_port("output")
+                        terminator1.bind(out1)
+                        ports.append(terminator1)
+                # bound ports are kept alive as long as the graph is
+                return builder, ports
+
+            def switch_pipeline(mode):
+                # every Builder opens its own instance of the devices, released when the Builder is destroyed,
+                # so the previous graph goes before the next one runs
+                # the saver output directories are build-time params, a recording always needs a new graph
+                self.pipeline = None
+                self.pipeline = build_pipeline(mode)
+                return self.pipeline[0]
+
+            mode = PREVIEW_MODE
+            builder = switch_pipeline(mode)
+
+            frame_ring.allocate(num_device, height, width, data_type, payloadsizes)
 
-                    display_bi_p = node.get_port("output")
-                    display_bi_p.bind(img_outputs)
+            while not self.stop:
+                builder.run()
+                if not (self.start_save and self.drop_preview_on_record):
+                    # save gendc
+                    if mode == GENDC_RECORD_MODE:
+                        frame_ring.put(gendc_outputs_data, True)
+                    # save image or previewing
+                    else:
+                        frame_ring.put(img_outputs_data, False)
 
-                # set the gain and exposure each run
-                for i in range(num_device):
+                if self.start_save != (mode != PREVIEW_MODE):
+                    switch_start = time.perf_counter()
+                    if self.start_save:
+                        mode = GENDC_RECORD_MODE if self.gendc_mode else IMAGE_RECORD_MODE
+                    else:
+                        mode = PREVIEW_MODE
+                    builder = None
+                    builder = switch_pipeline(mode)
+                    if mode != PREVIEW_MODE:
+                        builder.run()
+                        self.exclude = True
+                    self.report_switch(mode, time.perf_counter() - switch_start)
+
+                # rebind the gain and exposure only when they were changed
+                for i in self.gains.take_dirty():
                     gain_ps[i].bind(self.gains[i])
+                for i in self.exposuretimes.take_dirty():
                     exposure_ps[i].bind(self.exposuretimes[i])
         except Exception as e:
             log_write("Error", traceback.format_exc())
         finally:
-            clear_queue()  # empty the stream
-
-
-def resize(ori, ratio: int, cur_width: int, cur_height: int) -> np.ndarray:
-    if cur_width / cur_height < ratio:
-        resized_width = cur_width
-        resized_height = int(resized_width / ratio)
-    else:
-        resized_height = cur_height
-        resized_width = int(resized_height * ratio)
-
-    new = cv2.resize(ori, (resized_width, resized_height))
-    return new
+            self.pipeline = None  # release the devices
+            frame_ring.close()  # empty the stream
+            log_write("DEBUG", "Frame ring: skipped {} torn {}".format(frame_ring.skipped, frame_ring.torn))
+
+
+class PreviewScaler:
+    # frame -> largest size fitting the window with the frame aspect ratio
+    # size and interpolation are only recomputed when the window size changes
+    def __init__(self, width, height, interpolation="linear"):
+        self.width, self.height = width, height
+        self.smooth = interpolation == "area"
+        self.window_size = None
+        self.size = None
+        self.interpolation = None
+        self.buffer = None
+
+    def fit(self, window_size):
+        # (width, height) of the scaled frame
+        if window_size != self.window_size:
+            cur_width, cur_height = window_size
+            ratio = self.width / self.height
+            if cur_width / cur_height < ratio:
+                resized_width = cur_width
+                resized_height = max(1, int(resized_width / ratio))
+            else:
+                resized_height = cur_height
+                resized_width = max(1, int(resized_height * ratio))
+            self.set_size((resized_width, resized_height))
+            self.window_size = window_size
+        return self.size
+
+    def set_size(self, size):
+        # (width, height) chosen by the caller, the interpolation follows the scale factor
+        if size != self.size:
+            factor = self.width // size[0]
+            if size[0] * factor == self.width and size[1] * factor == self.height:
+                # integer factor: strided decimation, INTER_NEAREST picks exactly frame[::factor, ::factor]
+                self.interpolation = cv2.INTER_NEAREST
+            elif size[0] < self.width and self.smooth:
+                self.interpolation = cv2.INTER_AREA
+            else:
+                self.interpolation = cv2.INTER_LINEAR
+            self.size = size
+            self.window_size = None
+
+    def __call__(self, frame, out=None):
+        # scale with the geometry of the last fit(), into out or a buffer of the scaler
+        if out is None:
+            shape = (self.size[1], self.size[0]) + frame.shape[2:]
+            if self.buffer is None or self.buffer.shape != shape or self.buffer.dtype != frame.dtype:
+                self.buffer = np.empty(shape, dtype=frame.dtype)
+            out = self.buffer
+        return cv2.resize(frame, self.size, dst=out, interpolation=self.interpolation)
+
+
+class SuperpixelPreview:
+    # Bayer -> RGB straight at preview size: one RGB pixel per 2x2 Bayer quad, scaled, then white balanced
+    quad_offsets = {"BGGR": ((1, 1), (0, 1), (1, 0), (0, 0)), "RGGB": ((0, 0), (0, 1), (1, 0), (1, 1))}  # R G G B
+
+    def __init__(self, width, height, color_pattern, bit_width, interpolation="linear"):
+        self.offsets = self.quad_offsets[color_pattern]
+        self.bit_width = bit_width
+        self.scaler = PreviewScaler(width // 2, height // 2, interpolation)
+        self.gains = None
+        self.lut = None
+        self.channels = None
+
+    def __call__(self, raw, gains, out):
+        # raw: (height, width) Bayer frame in sensor bits, out: (h, w, 3) uint8 RGB preview
+        if gains != self.gains:
+            self.gains = gains
+            self.lut = get_color_lut(self.bit_width, gains)
+        self.scaler.set_size((out.shape[1], out.shape[0]))
+        height, width = raw.shape[0] // 2, raw.shape[1] // 2
+        quads = raw[:2 * height, :2 * width].reshape(height, 2, width, 2)
+        if self.scaler.interpolation != cv2.INTER_AREA:
+            # only every step-th quad is read, exactly the shown ones for an integer factor
+            step = max(1, width // out.shape[1])
+            quads = quads[::step, :, ::step, :]
+        (r_y, r_x), (g1_y, g1_x), (g2_y, g2_x), (b_y, b_x) = self.offsets
+        g1, g2 = quads[:, g1_y, :, g1_x], quads[:, g2_y, :, g2_x]
+        # floor((g1 + g2) / 2) without overflowing the buffer type
+        planes = [quads[:, r_y, :, r_x], (g1 >> 1) + (g2 >> 1) + (g1 & g2 & 1), quads[:, b_y, :, b_x]]
+        if self.scaler.interpolation != cv2.INTER_NEAREST:
+            planes = [cv2.resize(plane, self.scaler.size, interpolation=self.scaler.interpolation) for plane in planes]
+        if self.channels is None or self.channels[0].shape != out.shape[:2]:
+            self.channels = [np.empty(out.shape[:2], dtype=np.uint8) for _ in range(3)]
+        for lut, plane, channel in zip(self.lut, planes, self.channels):
+            # values above the sensor bit width map to the last entry
+            np.take(lut, plane, out=channel, mode="clip")
+        return cv2.merge(self.channels, dst=out)
+
+
+class PreviewSurface:
+    # one Tk photo image per panel, repainted in place, only reallocated when the preview size or mode changes
+    def __init__(self, panel):
+        self.panel = panel
+        self.image = None
+        self.mode = None
+
+    def paint(self, frame):
+        # frame: uint8 (height, width) or (height, width, 3) array, RGB
+        mode = "L" if frame.ndim == 2 else "RGB"
+        if self.image is None or self.mode != mode or \
+                (self.image.width(), self.image.height()) != (frame.shape[1], frame.shape[0]):
+            self.image = ImageTk.PhotoImage(mode, (frame.shape[1], frame.shape[0]))
+            self.mode = mode
+            self.panel.configure(image=self.image)
+        # Image.fromarray shares the array memory, paste copies it straight into the Tk photo
+        self.image.paste(Image.fromarray(frame))
 
 
 class Display:
@@ -305,149 +446,214 @@ class Display:
         self.dev_info, self.test_info = dev_info, test_info
 
         self.stop = False
-        self.panel0 = None
-        self.panel1 = None
+        # Tk widgets, only touched on the Tk main thread
+        self.master = None
+        self.roots = []
+        self.panels = []
+        self.surfaces = []
 
         self.is_redirected = False  # True only when saving - > display or display -> saving
 
         ## 3D image processing
-        self.r_gains = test_info["Red Gains"]
-        self.b_gains = test_info["Blue Gains"]
-        self.g_gains = test_info["Green Gains"]
+        self.r_gains = ParamStore(test_info["Red Gains"])
+        self.b_gains = ParamStore(test_info["Blue Gains"])
+        self.g_gains = ParamStore(test_info["Green Gains"])
 
         # dummy_image
         self.dummy_image = Image.open('./icon/loading-icon.jpg')
 
-    def _display(self, master, root0, display_frame0, root1=None, display_frame1=None):
+        # preview never refreshes faster than this, whatever the acquisition frame rate
+        self.refresh_interval = 1.0 / max(MIN_PREVIEW_RATE, test_info["Max Preview Rate"])
+        self.next_refresh = 0.0
+        self.render_interval_ms = max(1, int(1000 * self.refresh_interval))
+        # only preview every Nth captured frame
+        self.preview_every = max(1, test_info["Preview Every N Frames"])
+
+        # window/level (min, max) for the mono preview, None means the full range
+        self.level_min, self.level_max = test_info["Window Level"]
+        self.lut_level = None
+        self.lut = None
+
+        # image offset inside the GenDC container, read from the first GenDC frame of each device
+        self.gendc_image_offsets = [None] * dev_info["Number of Devices"]
+        self.gendc_warned = [False] * dev_info["Number of Devices"]
+
+        # hand-off from the display thread to the Tk main loop: newest ready-to-paint (seq, image) of each device
+        self.preview_frames = [None] * dev_info["Number of Devices"]
+        self.painted_seqs = [-1] * dev_info["Number of Devices"]
+        # window size of each device, updated from <Configure> events instead of queried for every frame
+        winfos = test_info["Window infos"]
+        self.window_sizes = [(winfos[2 * i], winfos[2 * i + 1]) for i in range(dev_info["Number of Devices"])]
+        self.scalers = [PreviewScaler(dev_info["Width"], dev_info["Height"], test_info["Preview Interpolation"])
+                        for _ in range(dev_info["Number of Devices"])]
+        self.preview_buffers = [[] for _ in range(dev_info["Number of Devices"])]
+        # the preview Tk is pasting from, the display thread doesn't write into it until paste returns
+        self.painting = [None] * dev_info["Number of Devices"]
+        self.preview_lock = threading.Lock()
+        self.preview_channels = [None] * dev_info["Number of Devices"]
+
+    def _next_frame(self, last_seq):
+        delay = self.next_refresh - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        # wake on frame arrival, or at the refresh deadline to check the stop flag
+        last_seq = last_seq + self.preview_every - 1
+        frame_ring.wait(last_seq, self.refresh_interval)
+        self.next_refresh = time.monotonic() + self.refresh_interval
+        return frame_ring.latest(last_seq)
+
+    def _get_lut(self, pixelformat):
+        # only regenerated when the window/level settings change
+        if self.lut is None or self.lut_level != (self.level_min, self.level_max):
+            self.lut_level = (self.level_min, self.level_max)
+            self.lut = get_preview_lut(pixelformat, self.level_min, self.level_max)
+        return self.lut
+
+    def _gendc_image_view(self, gendc_buffer, i, data_type):
+        width = self.dev_info["Width"]
+        height = self.dev_info["Height"]
+        image_size = width * height * np.dtype(data_type).itemsize
+        # the image at the end of the container, where the v1.2 camera puts it
+        offset = gendc_buffer.size - image_size
+        if self.gendc_image_offsets[i] is None:
+            try:
+                parsed_offset = get_gendc_image_offset(gendc_buffer)
+            except Exception as e:
+                # invalid or partially written descriptor, parsed again with the next frame
+                if not self.gendc_warned[i]:
+                    self.gendc_warned[i] = True
+                    log_write("WARNING", "Device {}: cannot read the GenDC descriptor ({}), "
+                                         "assume the image is at the end".format(i, e))
+                parsed_offset = None
+            if parsed_offset == -1 or parsed_offset is not None and not 0 <= parsed_offset <= offset:
+                log_write("WARNING", "Device {}: no image component in GenDC, assume it is at the end".format(i))
+                self.gendc_image_offsets[i] = offset
+            elif parsed_offset is not None:
+                self.gendc_image_offsets[i] = parsed_offset
+        if self.gendc_image_offsets[i] is not None:
+            offset = self.gendc_image_offsets[i]
+        # view into the slot buffer, no copy
+        return gendc_buffer[offset:offset + image_size].view(data_type).reshape(height, width)
+
+    def _preview_buffer(self, i, channels=1):
+        # display thread: a preallocated uint8 preview of device i at the cached window size,
+        # neither published nor being painted
+        width, height = self.scalers[i].fit(self.window_sizes[i])
+        shape = (height, width) if channels == 1 else (height, width, channels)
+        buffers = self.preview_buffers[i]
+        if len(buffers) == 0 or buffers[0].shape != shape:
+            # Tk keeps its own reference to a replaced buffer until it is painted
+            buffers[:] = [np.empty(shape, dtype=np.uint8) for _ in range(PREVIEW_BUFFERS)]
+        with self.preview_lock:
+            published = self.preview_frames[i][1] if self.preview_frames[i] is not None else None
+            return next(buffer for buffer in buffers if buffer is not published and buffer is not self.painting[i])
+
+    def _merge_planes(self, i, planes, out):
+        # display thread: (3, height, width) graph output -> each plane scaled, interleaved into out (h, w, 3)
+        channels = self.preview_channels[i]
+        if channels is None or channels[0].shape != out.shape[:2]:
+            channels = self.preview_channels[i] = [np.empty(out.shape[:2], dtype=np.uint8) for _ in range(3)]
+        for plane, channel in zip(planes, channels):
+            self.scalers[i](plane, out=channel)
+        return cv2.merge(channels, dst=out)
+
+    def _on_configure(self, i, root, event):
+        # bound on the toplevel, so also called for every child widget
+        if event.widget is root:
+            self.window_sizes[i] = (event.width, event.height)
+
+    def _render(self):
+        # Tk main thread: paint the newest preview of each device at the refresh rate
+        if self.stop:
+            for root in self.roots:
+                root.quit()
+            return
+        try:
+            for i, surface in enumerate(self.surfaces):
+                with self.preview_lock:
+                    preview = self.preview_frames[i]
+                    if preview is None or preview[0] == self.painted_seqs[i]:
+                        continue
+                    self.painting[i] = preview[1]
+                self.painted_seqs[i] = preview[0]
+                try:
+                    surface.paint(preview[1])
+                finally:
+                    with self.preview_lock:
+                        self.painting[i] = None
+        except Exception as e:
+            log_write("ERROR", "Rendering error: {}".format(traceback.format_exc()))
+        self.master.after(self.render_interval_ms, self._render)
+
+    def start_rendering(self, master, roots, display_frames):
+        # Tk main thread: loading image panels, painted by _render from now on
+        self.master = master
+        self.roots = roots
+        for i, (root, display_frame) in enumerate(zip(roots, display_frames)):
+            dummy_image_tk = ImageTk.PhotoImage(self.dummy_image.resize(self.window_sizes[i]))
+            panel = tk.Label(master=display_frame, image=dummy_image_tk)
+            panel.image = dummy_image_tk
+            panel.pack(fill="both")
+            self.panels.append(panel)
+            self.surfaces.append(PreviewSurface(panel))
+            root.bind("<Configure>", functools.partial(self._on_configure, i, root), add="+")
+        master.after(self.render_interval_ms, self._render)
+
+    def _display(self):
         try:
             if self.test_info["Color Display Mode"]:
-                self._display_3d(display_frame0, display_frame1, root0, root1)
+                self._display_3d()
             else:
-                self._display_2D(display_frame0, display_frame1, root0, root1)
-
-            if self.stop:
-                root0.quit()
-                if root1 is not None:
-                    root1.quit()
+                self._display_2D()
         except Exception as e:
             log_write("ERROR", "Previewing error: {}".format(traceback.format_exc()))
         finally:
             self.dummy_image.close()
 
-    def _display_2D(self, display_frame0, display_frame1, root0, root1):
+    def _display_2D(self):
         num_device = self.dev_info["Number of Devices"]
         pixelformat = self.dev_info["PixelFormat"]
         width = self.dev_info["Width"]
         height = self.dev_info["Height"]
-        ratio = width / height
         data_type = np.uint8 if required_bit_depth(pixelformat) == 8 else np.uint16
         depth_of_buffer = np.iinfo(data_type).bits
-        frames = [None] * 2
-        descriptor_sizes = []
-        num_bit_shift = get_num_bit_shift(pixelformat)
-        coef = pow(2, num_bit_shift)
-
-        dummy_image_tk0 = ImageTk.PhotoImage(self.dummy_image.resize((self.test_info["Window infos"][0], self.test_info["Window infos"][1])))
-
-        self.panel0 = tk.Label(master=display_frame0, image=dummy_image_tk0)
-        self.panel0.pack(fill="both")
-
-        if num_device == 2:
-            dummy_image_tk1 = ImageTk.PhotoImage(self.dummy_image.resize((self.test_info["Window infos"][2], self.test_info["Window infos"][3])))
-
-            self.panel1 = tk.Label(master=display_frame1, image=dummy_image_tk1)
-            self.panel1.pack(fill="both")
-
-
-        for i in range(num_device):
-            descriptor_sizes.append(self.dev_info["PayloadSize"][i] - self.dev_info["Width"] * self.dev_info[
-                "Height"] * depth_of_buffer // 8)  # specifically design for v1.2
+        previews = [None] * num_device
 
+        last_seq = -1
         while not self.stop:
             if self.is_redirected:
                 self.is_redirected = False
-                clear_queue()  # empty the stream
-            elif q.qsize() > MAX_BUF_SIZE:
-                clear_queue()
+                last_seq = frame_ring.flush()  # empty the stream
 
-            try:
-                binary_outputs_data, is_GenDC = q.get(block=False)  # don't block
-            except queue.Empty:
+            seq, slot = self._next_frame(last_seq)
+            if slot is None:
                 continue
-            if is_GenDC:
-                # to do
-                for i in range(num_device):
-                    frame = np.frombuffer(binary_outputs_data[i].tobytes()[descriptor_sizes[i]:], dtype=data_type)
-                    frame_copy = np.array(frame.reshape(height, width))
-                    frame_copy = frame_copy * coef
-                    if depth_of_buffer == 8:
-                        frames[i] = frame_copy.astype("uint8")
-                    else:
-                        frames[i] = (frame_copy / 256).astype("uint8")
-            else:
-                for i in range(num_device):
-                    frame = binary_outputs_data[i]
-                    frame = frame * coef
-                    if depth_of_buffer == 8:
-                        frames[i] = frame.astype("uint8")
-                    else:
-                        frames[i] = (frame / 256).astype("uint8")
-
-            frame0 = frames[0]
-
-            # resize image according to window size here
-            cur_width = root0.winfo_width()
-            cur_height = root0.winfo_height()
-            root0.geometry("{}x{}".format(cur_width, cur_height))
-            frame0 = resize(frame0, ratio, cur_width, cur_height)
-            image0 = ImageTk.PhotoImage(Image.fromarray(frame0))
-            if self.panel0 is None:
-                self.panel0 = tk.Label(master=display_frame0, image=image0)
-                self.panel0.image = image0
-                self.panel0.pack(fill="both")
-            # otherwise, simply update the panel
-            else:
-                self.panel0.configure(image=image0)
-                self.panel0.image = image0
-
-            # if the panel is not None, we need to initialize it
-            if num_device == 2:
-                frame1 = frames[1]
-                # resize image according to window size here
-                cur_width = root1.winfo_width()
-                cur_height = root1.winfo_height()
-                root1.geometry("{}x{}".format(cur_width, cur_height))
-                frame1 = resize(frame1, ratio, cur_width, cur_height)
-
-                image1 = ImageTk.PhotoImage(Image.fromarray(frame1))
-                if self.panel1 is None:
-                    self.panel1 = tk.Label(master=display_frame1, image=image1)
-                    self.panel1.image = image1
-                    self.panel1.pack(fill="both")
-                # otherwise, simply update the panel
+            lut = self._get_lut(pixelformat)
+            for i in range(num_device):
+                if slot.is_gendc:
+                    frame = self._gendc_image_view(slot.gendc[i], i, data_type)
+                else:
+                    frame = slot.images[i]
+                # scale first, the table is only applied to the window sized frame
+                previews[i] = self._preview_buffer(i)
+                if depth_of_buffer == 8 and self.lut_level == (None, None):
+                    self.scalers[i](frame, out=previews[i])  # identity table
                 else:
-                    self.panel1.configure(image=image1)
-                    self.panel1.image = image1
+                    # values are always within the table, "wrap" skips the bounds check
+                    np.take(lut, self.scalers[i](frame), out=previews[i], mode="wrap")
+            if not frame_ring.is_intact(seq, slot):
+                continue
+            last_seq = seq
+            for i in range(num_device):
+                self.preview_frames[i] = (seq, previews[i])
 
-    def _display_3d(self, display_frame0, display_frame1, root0, root1):
+    def _display_3d(self):
         # is is better to use opencv?
         width = self.dev_info["Width"]
         height = self.dev_info["Height"]
-        ratio = width / height
         num_device = self.dev_info["Number of Devices"]
         pixelformat = self.dev_info["PixelFormat"]
 
-        # display dummy image first
-        dummy_image_tk0 = ImageTk.PhotoImage(self.dummy_image.resize((self.test_info["Window infos"][0], self.test_info["Window infos"][1])))
-
-        self.panel0 = tk.Label(master=display_frame0, image=dummy_image_tk0)
-        self.panel0.pack(fill="both")
-
-        if num_device == 2:
-            dummy_image_tk1 = ImageTk.PhotoImage(self.dummy_image.resize((self.test_info["Window infos"][2], self.test_info["Window infos"][3])))
-            self.panel1 = tk.Label(master=display_frame1, image=dummy_image_tk1)
-            self.panel1.pack(fill="both")
-
         # set I/O port
         wp = Port("width", Type(TypeCode.Int, 32, 1), 0)
         hp = Port("height", Type(TypeCode.Int, 32, 1), 0)
@@ -498,14 +704,7 @@ class Display:
                 g_gain_ports[i],
                 b_gain_ports[i],
                 node.get_port("output")])  # output(x, y, c)
-
-            node = builder.add("base_reorder_buffer_3d_uint8") \
-                .set_iports([node.get_port("output")]) \
-                .set_params([
-                Param("dim0", "2"),
-                Param("dim1", "0"),
-                Param("dim2", "1"),
-            ])  # output(c, x, y)
+            # planar output, interleaved by _merge_planes after scaling instead of a full resolution reorder
             display_color_p = node.get_port("output")
             display_color_ports.append(display_color_p)
         # display_color_p0 = display_color_ports[0]
@@ -519,7 +718,7 @@ class Display:
             g_gain_ports[i].bind(self.g_gains[i])
             b_gain_ports[i].bind(self.b_gains[i])
         for i in range(num_device):
-            rgb_outputs_data.append(np.full((height, width, 3), fill_value=0, dtype=np.uint8))
+            rgb_outputs_data.append(np.full((3, height, width), fill_value=0, dtype=np.uint8))
             rgb_outputs.append(Buffer(array=rgb_outputs_data[i]))
         for i in range(num_device):
             binary_input_data.append(np.full((height, width), fill_value=0, dtype=data_type))
@@ -527,73 +726,47 @@ class Display:
             display_color_ports[i].bind(rgb_outputs[i])
             input_ports[i].bind(binary_inputs[i])
 
-        descriptor_sizes = []
-        for i in range(num_device):
-            descriptor_sizes.append(self.dev_info["PayloadSize"][i] - self.dev_info["Width"] * self.dev_info[
-                "Height"] * depth_of_buffer // 8)  # specifically design for v1.2
+        # windows of at most half the sensor size skip the full resolution graph
+        superpixels = [SuperpixelPreview(width, height, self.test_info["Color Pattern"], get_bit_width(pixelformat),
+                                         self.test_info["Preview Interpolation"]) for _ in range(num_device)]
+        previews = [None] * num_device
 
+        last_seq = -1
         while not self.stop:
             if self.is_redirected:
                 self.is_redirected = False
-                clear_queue()  # empty the stream
-            elif q.qsize() > MAX_BUF_SIZE:
-                clear_queue()
+                last_seq = frame_ring.flush()  # empty the stream
 
-            try:
-                binary_outputs_data, is_GenDC = q.get(block=False)  # don't block
-            except queue.Empty:
+            seq, slot = self._next_frame(last_seq)
+            if slot is None:
                 continue
 
-            if is_GenDC:
-                for i in range(num_device):
-                    # to do
-                    binary_output_image_data = np.frombuffer(binary_outputs_data[i].tobytes()[descriptor_sizes[i]:],
-                                                             dtype=data_type)
-                    np.copyto(binary_input_data[i], binary_output_image_data.reshape(height, width))
-
-            else:
-                for i in range(num_device):
-                    np.copyto(binary_input_data[i], binary_outputs_data[i])
-            builder.run()
+            full_resolution = [2 * self.scalers[i].fit(self.window_sizes[i])[0] > width for i in range(num_device)]
             for i in range(num_device):
+                frame = self._gendc_image_view(slot.gendc[i], i, data_type) if slot.is_gendc else slot.images[i]
+                if full_resolution[i]:
+                    # the graph keeps reading the buffer bound at its first run, so frames are copied into it
+                    np.copyto(binary_input_data[i], frame)
+                else:
+                    previews[i] = superpixels[i](frame, (self.r_gains[i], self.g_gains[i], self.b_gains[i]),
+                                                 self._preview_buffer(i, 3))
+            if not frame_ring.is_intact(seq, slot):
+                continue
+            last_seq = seq
+            if any(full_resolution):
+                builder.run()
+            for i in self.r_gains.take_dirty():
                 r_gain_ports[i].bind(self.r_gains[i])
+            for i in self.g_gains.take_dirty():
                 g_gain_ports[i].bind(self.g_gains[i])
+            for i in self.b_gains.take_dirty():
                 b_gain_ports[i].bind(self.b_gains[i])
 
-            frame0 = rgb_outputs_data[0]
-
-            cur_width = root0.winfo_width()
-            cur_height = root0.winfo_height()
-            root0.geometry("{}x{}".format(cur_width, cur_height))
-            frame0 = resize(frame0, ratio, cur_width, cur_height)
+            for i in range(num_device):
+                if full_resolution[i]:
+                    previews[i] = self._merge_planes(i, rgb_outputs_data[i], self._preview_buffer(i, 3))
+                self.preview_frames[i] = (seq, previews[i])
 
-            image0 = ImageTk.PhotoImage(Image.fromarray(frame0))
-            if self.panel0 is None:
-                self.panel0 = tk.Label(master=display_frame0, image=image0)
-                self.panel0.image = image0
-                self.panel0.pack(fill="both")
-            # otherwise, simply update the panel
-            else:
-                self.panel0.configure(image=image0)
-                self.panel0.image = image0
-
-            # if the panel is not None, we need to initialize it
-            if num_device == 2:
-                frame1 = rgb_outputs_data[1]
-                cur_width = root1.winfo_width()
-                cur_height = root1.winfo_height()
-
-                root1.geometry("{}x{}".format(cur_width, cur_height))
-                frame1 = resize(frame1, ratio, cur_width, cur_height)
-                image1 = ImageTk.PhotoImage(Image.fromarray(frame1))
-                if self.panel1 is None:
-                    self.panel1 = tk.Label(master=display_frame1, image=image1)
-                    self.panel1.image = image1
-                    self.panel1.pack(fill="both")
-                # otherwise, simply update the panel
-                else:
-                    self.panel1.configure(image=image1)
-                    self.panel1.image = image1
+    def run(self):
+        self._display()
 
-    def run(self, master, root0, display_frame0, root1=None, display_frame1=None):
-        self._display(master, root0, display_frame0, root1, display_frame1)
@@ -1,26 +1,611 @@
+import argparse
+import collections
+import functools
+import itertools
 import json
+import struct
+import multiprocessing
+import queue
 import shutil
+import threading
 import time
 import traceback
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 import cv2
 import numpy as np
 from PIL import Image
 import os
 # Define width and height
-from utils import log_write, required_bit_depth, get_num_bit_shift
+from utils import log_write, required_bit_depth, get_num_bit_shift, get_bit_width, get_color_lut, GDC_INTENSITY
 from utils import DEFAULT_PREFIX_NAME0, DEFAULT_PREFIX_NAME1, DEFAULT_GENDC_PREFIX_NAME0, DEFAULT_GENDC_PREFIX_NAME1
 from gendc_python.gendc_separator import descriptor as gendc
 
-GDC_INTENSITY = 1
+FRAMES_PER_SHARD = 8  # frames of one bin file converted by one worker task
+VIDEO_QUEUE_SIZE = 16  # frames buffered between the mp4 encoding stages
+MAX_BATCH_BYTES = 4 << 20  # mono batches stay cache sized, bigger stacks are slower than frame by frame
+PACKED_RECORDING_NAME = "recording.pack"  # per camera directory, after the bin prefix: image0-recording.pack
+PACKED_FRAMES_PER_CHUNK = 8  # frames compressed together, the unit of random access in a packed recording
+FRAME_INDEX_NAME = "frame_index.npy"  # per camera directory, after the bin prefix: image0-frame_index.npy
+FRAME_INDEX_DTYPE = np.dtype([("frame_id", "<u4"),
+                              ("file", "<u4"),  # number of the bin file, image0-<file>.bin
+                              ("offset", "<u8"),  # byte offset of the frame in that file
+                              ("timestamp", "<u8"),  # GenDC component timestamp, 0 in image mode
+                              ("payload_size", "<u4")])
+
+
+class BinFrameReader:
+    # image-mode bin file: (uint32 frame_id, uint8/uint16 pixels[height][width]) records back to back
+    def __init__(self, file_path, height, width, required_bit):
+        self.file_path = file_path
+        self.dtype = np.dtype([("frame_id", "<u4"),
+                               ("pixels", np.uint8 if required_bit == 8 else np.uint16, (height, width))])
+        file_size = os.path.getsize(file_path)
+        self.num_frames = file_size // self.dtype.itemsize
+        self.incomplete_bytes = file_size % self.dtype.itemsize
+        if self.num_frames > 0:
+            # a plain ndarray view: ufuncs and slices of a np.memmap go through its Python hooks
+            self.records = np.memmap(file_path, dtype=self.dtype, mode="r",
+                                     shape=(self.num_frames,)).view(np.ndarray)
+        else:
+            self.records = np.zeros((0,), dtype=self.dtype)  # an empty file can't be mapped
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return self.num_frames
+
+    def __getitem__(self, idx):
+        # (frame_id, pixels view) of the idx-th frame in the file
+        record = self.records[idx]
+        return int(record["frame_id"]), record["pixels"]
+
+    def frames(self, start=0, stop=None, step=1):
+        stop = self.num_frames if stop is None else stop
+        for idx in range(start, min(stop, self.num_frames), step):
+            yield self[idx]
+        if stop > self.num_frames and self.incomplete_bytes > 0:
+            log_write("Warning", "Incomplete image at the end of {}".format(self.file_path))
+
+    def batches(self, start=0, stop=None, step=1, batch_size=1):
+        # (frame_ids, (n, height, width) pixels view) of up to batch_size frames at a time
+        stop = self.num_frames if stop is None else stop
+        end = min(stop, self.num_frames)
+        for first in range(start, end, step * batch_size):
+            records = self.records[first:min(end, first + step * batch_size):step]
+            yield records["frame_id"].tolist(), records["pixels"]
+        if stop > self.num_frames and self.incomplete_bytes > 0:
+            log_write("Warning", "Incomplete image at the end of {}".format(self.file_path))
+
+    def close(self):
+        # views handed out keep the mapping alive until they are released
+        self.records = None
+
+
+class GenDCFrameReader:
+    # gendc-mode bin file: one GenDC container every payload_in_byte bytes, parsed in place over the mapping
+    def __init__(self, file_path, payload_in_byte):
+        self.file_path = file_path
+        self.payload_in_byte = payload_in_byte
+        file_size = os.path.getsize(file_path)
+        self.num_frames = -(-file_size // payload_in_byte)
+        if file_size > 0:
+            self.buffer = memoryview(np.memmap(file_path, dtype=np.uint8, mode="r"))
+        else:
+            self.buffer = memoryview(b"")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return self.num_frames
+
+    def __getitem__(self, idx):
+        # (frame_id, image component, part 0 data view) of the idx-th container, None without an image component
+        gendc_container = gendc.Container(self.buffer[idx * self.payload_in_byte:])
+        # get first available image component
+        image_component_idx = gendc_container.get_1st_component_idx_by_typeid(GDC_INTENSITY)
+        if image_component_idx == -1:
+            return None
+        image_component = gendc_container.get_component_by_index(image_component_idx)
+        part = image_component.get_part_by_index(0)
+        # Access to Comp 0, Part 0's TypeSpecific 3 (where typespecific count start with 1; therefore, index is 2)
+        typespecific3 = part.get_typespecific_by_index(2)
+        # Access to the first 4-byte of typespecific3
+        frame_id = int.from_bytes(typespecific3.to_bytes(8, 'little')[0:4], "little")
+        return frame_id, image_component, part.get_data()
+
+    def frames(self, start=0, stop=None, step=1):
+        # yields (frame_id, image component, part 0 data view) for every container with an image component
+        stop = self.num_frames if stop is None else min(stop, self.num_frames)
+        for idx in range(start, stop, step):
+            try:
+                frame = self[idx]
+            except Exception as e:
+                log_write("ERROR", "convert single frame in {} failed : {}".format(self.file_path, e))
+                continue
+            if frame is not None:
+                yield frame
+
+    def close(self):
+        # views handed out keep the mapping alive until they are released
+        self.buffer = None
+
+
+def pack_bits(pixels, bits):
+    # 10/12 bit pixels in uint16 -> the high 8 bits of every pixel, then the remaining low bits 4 or 2 per byte
+    # the high byte plane of an image compresses well, the noisy low bits are kept apart from it
+    if bits not in (10, 12):
+        return pixels.tobytes()
+    low_bits = bits - 8
+    per_byte = 8 // low_bits
+    values = np.zeros(-(-pixels.size // per_byte) * per_byte, dtype=np.uint16)
+    values[:pixels.size] = pixels.ravel()
+    high = (values >> low_bits).astype(np.uint8)
+    low = (values & ((1 << low_bits) - 1)).astype(np.uint8).reshape(-1, per_byte)
+    packed_low = low[:, 0].copy()
+    for k in range(1, per_byte):
+        packed_low |= low[:, k] << (k * low_bits)
+    return high[:pixels.size].tobytes() + packed_low.tobytes()
+
+
+def unpack_bits(data, bits, count, dtype):
+    # inverse of pack_bits, count pixels of dtype
+    if bits not in (10, 12):
+        return np.frombuffer(data, dtype=dtype, count=count)
+    low_bits = bits - 8
+    per_byte = 8 // low_bits
+    data = np.frombuffer(data, dtype=np.uint8)
+    values = data[:count].astype(np.uint16) << low_bits
+    packed_low = data[count:]
+    low = np.empty((len(packed_low), per_byte), dtype=np.uint8)
+    for k in range(per_byte):
+        low[:, k] = (packed_low >> (k * low_bits)) & ((1 << low_bits) - 1)
+    values |= low.ravel()[:count]
+    return values
+
+
+class PackedRecordingWriter:
+    # image-mode recording of one camera in one file: header, zlib compressed chunks of bit packed frames, tables
+    # header: magic, version, storage bits, height, width, number of chunks, number of frames, tables offset
+    header_format = "<4sHHIIIQQ"
+    magic = b"BPCK"
+    # a chunk is the zlib compressed high byte plane (or all pixels for 8/16 bit) followed by the raw low bits
+    chunk_dtype = np.dtype([("offset", "<u8"), ("size", "<u8"), ("compressed_size", "<u8"), ("first_frame", "<u8"),
+                            ("num_frames", "<u4"),
+                            ("bits", "<u2")])  # bits per pixel of the chunk, storage bits if a pixel didn't fit
+    frame_dtype = np.dtype([("frame_id", "<u4"), ("file", "<u4")])  # file: number of the bin file it came from
+
+    def __init__(self, file_path, height, width, required_bit, bits, compression_level=1):
+        self.file_path = file_path
+        self.height, self.width = height, width
+        self.required_bit = required_bit
+        self.bits = bits
+        self.compression_level = compression_level
+        self.f = open(file_path, "wb")
+        self.f.write(b"\0" * struct.calcsize(self.header_format))
+        self.chunks = []
+        self.frames = []
+        self.pending = []
+        self.raw_bytes = 0
+        self.frames_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def add(self, frame_ids, img_stack, file_number):
+        self.frames.extend((frame_id, file_number) for frame_id in frame_ids)
+        self.pending.extend(img_stack)
+        while len(self.pending) >= PACKED_FRAMES_PER_CHUNK:
+            self.write_chunk(self.pending[:PACKED_FRAMES_PER_CHUNK])
+            del self.pending[:PACKED_FRAMES_PER_CHUNK]
+
+    def write_chunk(self, frames):
+        pixels = np.stack(frames)
+        self.raw_bytes += pixels.nbytes
+        # lossless only: a chunk with a pixel above the sensor bit width keeps every storage bit
+        bits = self.bits if int(pixels.max()) < (1 << self.bits) else self.required_bit
+        data = pack_bits(pixels, bits)
+        # the noisy low bits hardly compress, zlib only gets the high byte plane
+        split = pixels.size if bits in (10, 12) else len(data)
+        compressed = zlib.compress(data[:split], self.compression_level)
+        self.chunks.append((self.f.tell(), len(compressed) + len(data) - split, len(compressed),
+                            self.frames_written, len(frames), bits))
+        self.frames_written += len(frames)
+        self.f.write(compressed)
+        self.f.write(data[split:])
+
+    def close(self):
+        if self.f is None:
+            return
+        if self.pending:
+            self.write_chunk(self.pending)
+            self.pending = []
+        tables_offset = self.f.tell()
+        self.f.write(np.array(self.chunks, dtype=self.chunk_dtype).tobytes())
+        self.f.write(np.array(self.frames, dtype=self.frame_dtype).tobytes())
+        self.f.seek(0)
+        self.f.write(struct.pack(self.header_format, self.magic, 1, self.required_bit, self.height, self.width,
+                                 len(self.chunks), len(self.frames), tables_offset))
+        self.f.close()
+        self.f = None
+
+
+class PackedRecordingReader:
+    # random access to a PackedRecordingWriter file, one chunk decompressed at a time
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.f = open(file_path, "rb")
+        header = self.f.read(struct.calcsize(PackedRecordingWriter.header_format))
+        magic, version, self.required_bit, self.height, self.width, num_chunks, self.num_frames, tables_offset = \
+            struct.unpack(PackedRecordingWriter.header_format, header)
+        if magic != PackedRecordingWriter.magic:
+            raise ValueError("{} is not a packed recording".format(file_path))
+        self.dtype = np.uint8 if self.required_bit == 8 else np.uint16
+        self.f.seek(tables_offset)
+        self.chunks = np.fromfile(self.f, dtype=PackedRecordingWriter.chunk_dtype, count=num_chunks)
+        self.frame_table = np.fromfile(self.f, dtype=PackedRecordingWriter.frame_dtype, count=self.num_frames)
+        self.cached_chunk = (-1, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return self.num_frames
+
+    def read_chunk(self, chunk_idx):
+        # (num_frames, height, width) pixels of one chunk
+        if self.cached_chunk[0] != chunk_idx:
+            chunk = self.chunks[chunk_idx]
+            self.f.seek(int(chunk["offset"]))
+            data = self.f.read(int(chunk["size"]))
+            data = zlib.decompress(data[:int(chunk["compressed_size"])]) + data[int(chunk["compressed_size"]):]
+            count = int(chunk["num_frames"]) * self.height * self.width
+            pixels = unpack_bits(data, int(chunk["bits"]), count, self.dtype)
+            self.cached_chunk = (chunk_idx, pixels.reshape(-1, self.height, self.width))
+        return self.cached_chunk[1]
+
+    def __getitem__(self, idx):
+        # (frame_id, pixels) of the idx-th frame
+        chunk_idx = int(np.searchsorted(self.chunks["first_frame"], idx, side="right")) - 1
+        pixels = self.read_chunk(chunk_idx)[idx - int(self.chunks["first_frame"][chunk_idx])]
+        return int(self.frame_table["frame_id"][idx]), pixels
+
+    def batches(self):
+        # (frame_ids, file numbers, (n, height, width) pixels) chunk by chunk
+        for chunk_idx, chunk in enumerate(self.chunks):
+            first, last = int(chunk["first_frame"]), int(chunk["first_frame"] + chunk["num_frames"])
+            yield (self.frame_table["frame_id"][first:last].tolist(), self.frame_table["file"][first:last].tolist(),
+                   self.read_chunk(chunk_idx))
+
+    def close(self):
+        self.f.close()
+
+
+class ColorStage:
+    # Bayer -> RGB (or BGR) demosaic followed by one white balance lookup per channel, no float temporaries
+    demosaic_codes = {("BGGR", False): cv2.COLOR_BayerBGGR2RGB, ("RGGB", False): cv2.COLOR_BayerRGGB2RGB,
+                      ("BGGR", True): cv2.COLOR_BayerBGGR2BGR, ("RGGB", True): cv2.COLOR_BayerRGGB2BGR}
+
+    def __init__(self, color_pattern, r_gain=1.0, g_gain=1.0, b_gain=1.0, bgr=False):
+        self.demosaic_code = self.demosaic_codes[(color_pattern, bgr)]
+        self.gains = (b_gain, g_gain, r_gain) if bgr else (r_gain, g_gain, b_gain)
+        self.luts = {}
+
+    def get_lut(self, dtype):
+        if dtype not in self.luts:
+            lut = get_color_lut(8 * dtype.itemsize, self.gains)
+            # cv2.LUT takes a (1, 256, channels) table for uint8 images
+            self.luts[dtype] = np.ascontiguousarray(lut.T).reshape(1, 256, 3) if dtype == np.uint8 else lut
+        return self.luts[dtype]
+
+    def __call__(self, img_arr):
+        # uint8/uint16 2D Bayer image in full scale -> new uint8 3 channel image
+        demosaiced = np.empty(img_arr.shape + (3,), dtype=img_arr.dtype)
+        out = np.empty(img_arr.shape + (3,), dtype=np.uint8)
+        cv2.cvtColor(img_arr, self.demosaic_code, dst=demosaiced)
+        lut = self.get_lut(img_arr.dtype)
+        if img_arr.dtype == np.uint8:
+            cv2.LUT(demosaiced, lut, dst=out)
+        else:
+            for c in range(3):
+                np.take(lut[c], demosaiced[..., c], out=out[..., c], mode="wrap")
+        return out
+
+
+class ImageSink:
+    # one <frame_id>.<extension> file per frame encoded on a thread pool, raw keeps the bin file pixels as they are
+    def __init__(self, output_directory, extension, encoder="pil", png_compression=6, jpeg_quality=75,
+                 num_threads=1):
+        self.output_directory = output_directory
+        self.extension = extension
+        self.encoder = encoder  # "pil" or "cv2", cv2 expects BGR color frames
+        if extension == "png":
+            self.pil_params = {"compress_level": png_compression}
+            self.cv2_params = [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+        elif extension in ("jpg", "jpeg"):
+            self.pil_params = {"quality": jpeg_quality}
+            self.cv2_params = [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality]
+        else:
+            self.pil_params = {}
+            self.cv2_params = []
+        self.pool = ThreadPoolExecutor(max_workers=num_threads)
+        self.max_pending = 2 * num_threads
+        self.pending = collections.deque()
+        self.lock = threading.Lock()
+        self.num_frames = 0
+        self.num_bytes = 0
+        self.busy = 0.0
+        self.num_errors = 0
+
+    def write(self, frame_id, img_arr):
+        # img_arr must stay untouched until it is encoded
+        if len(self.pending) >= self.max_pending:
+            self.pending.popleft().result()
+        file_path = os.path.join(self.output_directory, str(frame_id) + "." + self.extension)
+        self.pending.append(self.pool.submit(self.encode, file_path, img_arr))
+
+    def encode(self, file_path, img_arr):
+        start = time.perf_counter()
+        try:
+            if self.extension == "raw":
+                img_arr.tofile(file_path)
+            elif self.encoder == "cv2":
+                succeed, encoded = cv2.imencode("." + self.extension, img_arr, self.cv2_params)
+                if not succeed:
+                    raise RuntimeError("cv2.imencode failed")
+                encoded.tofile(file_path)
+            else:
+                Image.fromarray(img_arr).save(file_path, **self.pil_params)
+            num_bytes = os.path.getsize(file_path)
+        except Exception as e:
+            log_write("ERROR", "saving {} failed : {}".format(file_path, e))
+            with self.lock:
+                self.num_errors += 1
+            return
+        with self.lock:
+            self.num_frames += 1
+            self.num_bytes += num_bytes
+            self.busy += time.perf_counter() - start
+
+    def close(self):
+        # waits for every frame, returns (frames, bytes, encoding seconds summed over the threads, failed frames)
+        try:
+            while self.pending:
+                self.pending.popleft().result()
+        finally:
+            self.pool.shutdown()
+        return self.num_frames, self.num_bytes, self.busy, self.num_errors
+
+
+class VideoSink:
+    # frames appended to an opened cv2.VideoWriter, in the order they are written
+    def __init__(self, video_writer):
+        self.video_writer = video_writer
+
+    def write(self, frame_id, img_arr):
+        self.video_writer.write(img_arr)
+
+    def close(self):
+        # the writer is released by its owner
+        return None
+
+
+def get_bin_prefix(is_gendc, i):
+    if is_gendc:
+        return DEFAULT_GENDC_PREFIX_NAME0 if i == 0 else DEFAULT_GENDC_PREFIX_NAME1
+    return DEFAULT_PREFIX_NAME0 if i == 0 else DEFAULT_PREFIX_NAME1
+
+
+def is_reduced_to_8bit(required_bit, extension):
+    # png and mp4 keep 16 bit, the other image formats only support 8 bit
+    return required_bit == 16 and extension not in ("png", "mp4")
+
+
+def get_bin_number(file_name):
+    # image0-12.bin -> 12
+    return int(file_name[:-len(".bin")].rsplit("-", 1)[1])
+
+
+def list_bin_files(output_directory):
+    # bin files of one camera directory in recording order
+    file_list = [f for f in os.listdir(output_directory) if f.endswith(".bin")]  # exclude the json file
+    file_list.sort(key=get_bin_number)
+    return file_list
+
+
+def build_frame_index(output_directory, prefix, is_gendc, height, width, required_bit, payload_in_byte,
+                      rotate_limit=60):
+    # one FRAME_INDEX_DTYPE record per frame of the directory, in recording order
+    entries = []
+    for file in list_bin_files(output_directory):
+        file_path = os.path.join(output_directory, file)
+        file_number = get_bin_number(file)
+        if not is_gendc:
+            with BinFrameReader(file_path, height, width, required_bit) as reader:
+                num_frames = min(rotate_limit, len(reader))
+                entry = np.zeros(num_frames, dtype=FRAME_INDEX_DTYPE)
+                entry["frame_id"] = reader.records["frame_id"][:num_frames]
+                entry["offset"] = np.arange(num_frames) * reader.dtype.itemsize
+                entry["payload_size"] = reader.dtype["pixels"].itemsize
+                if reader.incomplete_bytes > 0:
+                    log_write("Warning", "Incomplete image at the end of {}".format(file_path))
+                # image-mode bin files don't record a timestamp
+        else:
+            with GenDCFrameReader(file_path, payload_in_byte) as reader:
+                frames = []
+                for idx in range(min(rotate_limit, len(reader))):
+                    try:
+                        frame = reader[idx]
+                    except Exception as e:
+                        log_write("ERROR", "indexing frame {} of {} failed : {}".format(idx, file_path, e))
+                        continue
+                    if frame is not None:
+                        frame_id, image_component, data = frame
+                        frames.append((frame_id, 0, idx * payload_in_byte, image_component.get("Timestamp"),
+                                       len(data)))
+                entry = np.array(frames, dtype=FRAME_INDEX_DTYPE)
+        entry["file"] = file_number
+        entries.append(entry)
+    frame_index = np.concatenate(entries) if entries else np.zeros(0, dtype=FRAME_INDEX_DTYPE)
+    np.save(os.path.join(output_directory, prefix + FRAME_INDEX_NAME), frame_index)
+    return frame_index
+
+
+def load_frame_index(output_directory, prefix):
+    # the saved index, or None when it is missing or older than one of the bin files
+    index_path = os.path.join(output_directory, prefix + FRAME_INDEX_NAME)
+    try:
+        index_time = os.path.getmtime(index_path)
+        if any(os.path.getmtime(os.path.join(output_directory, f)) > index_time
+               for f in list_bin_files(output_directory)):
+            return None
+        # read, not mapped: Windows can't delete the file or move its directory while it is mapped
+        return np.load(index_path)
+    except (OSError, ValueError):
+        return None
+
+
+def select_frames(frame_index, frame_range=None, time_range=None, frame_step=1, fps=None):
+    # frames [first, last] by frame_id and/or [start, end] seconds from the first frame, then every frame_step-th
+    selected = np.asarray(frame_index)
+    if len(selected) == 0:
+        return selected
+    if time_range is not None:
+        if selected["timestamp"].any():
+            seconds = (selected["timestamp"] - selected["timestamp"][0]) / 1e9
+        else:
+            # image-mode bin files have no timestamp, go by the frame counter instead
+            seconds = (selected["frame_id"].astype(np.int64) - int(selected["frame_id"][0])) / fps
+        selected = selected[(seconds >= time_range[0]) & (seconds <= time_range[1])]
+    if frame_range is not None:
+        selected = selected[(selected["frame_id"] >= frame_range[0]) & (selected["frame_id"] <= frame_range[1])]
+    return selected[::frame_step]
+
+
+def get_frame_runs(frame_index, frame_stride, max_length=None):
+    # (file number, start, stop, step) runs of evenly spaced frames within one bin file, in index order
+    runs = []
+    for file_number in dict.fromkeys(frame_index["file"].tolist()):
+        positions = (frame_index["offset"][frame_index["file"] == file_number] // frame_stride).tolist()
+        start = 0
+        while start < len(positions):
+            step = positions[start + 1] - positions[start] if start + 1 < len(positions) else 1
+            stop = start + 1
+            while stop < len(positions) and positions[stop] - positions[stop - 1] == step and \
+                    (max_length is None or stop - start < max_length):
+                stop += 1
+            runs.append((file_number, positions[start], positions[stop - 1] + 1, step))
+            start = stop
+    return runs
 
 
 class Converter:
     def __init__(self, dev_info, test_info):
         self.dev_info, self.test_info = dev_info, test_info
+        # worker processes for image conversion, 0 means one per CPU
+        self.num_workers = test_info["Conversion Workers"] or os.cpu_count()
+        # frames processed together by the mono path, color frames are always processed one by one
+        self.batch_size = max(1, test_info["Conversion Batch Size"])
+        self.image_encoder = test_info["Image Encoder"]
+        self.png_compression = test_info["PNG Compression Level"]
+        self.jpeg_quality = test_info["JPEG Quality"]
+        self.encoding_threads = max(1, test_info["Encoding Threads"])
+
+    def get_frame_indices(self, output_directories, is_gendc, rotate_limit=60):
+        # frame index of every camera directory, (re)built when it is missing or out of date
+        required_bit = required_bit_depth(self.dev_info["PixelFormat"])
+        frame_indices = []
+        for i in range(self.dev_info["Number of Devices"]):
+            output_directory = output_directories[i]
+            prefix = get_bin_prefix(is_gendc, i)
+            frame_index = load_frame_index(output_directory, prefix)
+            if frame_index is None:
+                frame_index = build_frame_index(output_directory, prefix, is_gendc,
+                                                self.dev_info["Height"], self.dev_info["Width"], required_bit,
+                                                self.dev_info["PayloadSize"][i], rotate_limit)
+                log_write("DEBUG", "Device {}: indexed {} frames in {}".format(i, len(frame_index), output_directory))
+            frame_indices.append(frame_index)
+        return frame_indices
+
+    def pack_recording(self, output_directories, compression_level=1, to_delete=False, time_out=5):
+        # image-mode bin files of every camera directory -> <prefix>recording.pack, bit packed and zlib compressed
+        pixelformat = self.dev_info["PixelFormat"]
+        height, width = self.dev_info["Height"], self.dev_info["Width"]
+        required_bit = required_bit_depth(pixelformat)
+        for i in range(self.dev_info["Number of Devices"]):
+            output_directory = output_directories[i]
+            prefix = get_bin_prefix(False, i)
+            pack_path = os.path.join(output_directory, prefix + PACKED_RECORDING_NAME)
+            try:
+                file_paths = [os.path.join(output_directory, f) for f in list_bin_files(output_directory)]
+                with PackedRecordingWriter(pack_path, height, width, required_bit, get_bit_width(pixelformat),
+                                           compression_level) as writer:
+                    for file_path in file_paths:
+                        with BinFrameReader(file_path, height, width, required_bit) as reader:
+                            for frame_ids, img_stack in reader.batches(batch_size=PACKED_FRAMES_PER_CHUNK):
+                                writer.add(frame_ids, img_stack, get_bin_number(os.path.basename(file_path)))
+                            if reader.incomplete_bytes > 0:
+                                log_write("Warning", "Incomplete image at the end of {} is not packed".format(
+                                    file_path))
+                log_write("INFO", "Device {}: packed {} frames, {:.1f} MB into {:.1f} MB".format(
+                    i, len(writer.frames), writer.raw_bytes / 1e6, os.path.getsize(pack_path) / 1e6))
+                if to_delete:
+                    for file_path in file_paths:
+                        del_bin(file_path, time_out)
+                    del_frame_index(output_directory, prefix, time_out)
+            except Exception as e:
+                log_write("Error", traceback.format_exc())
+
+    def unpack_recording(self, output_directories, to_delete=False, time_out=5):
+        # <prefix>recording.pack -> the original image-mode bin files, byte for byte
+        for i in range(self.dev_info["Number of Devices"]):
+            output_directory = output_directories[i]
+            prefix = get_bin_prefix(False, i)
+            pack_path = os.path.join(output_directory, prefix + PACKED_RECORDING_NAME)
+            f = None
+            try:
+                with PackedRecordingReader(pack_path) as reader:
+                    file_number = None
+                    for frame_ids, file_numbers, img_stack in reader.batches():
+                        for frame_id, number, img_arr in zip(frame_ids, file_numbers, img_stack):
+                            if number != file_number:
+                                if f is not None:
+                                    f.close()
+                                file_number = number
+                                f = open(os.path.join(output_directory, "{}{}.bin".format(prefix, file_number)), "wb")
+                            f.write(struct.pack("<I", frame_id))
+                            f.write(img_arr.tobytes())
+                    log_write("INFO", "Device {}: unpacked {} frames from {}".format(i, len(reader), pack_path))
+                if f is not None:
+                    f.close()
+                    f = None
+                if to_delete:
+                    del_bin(pack_path, time_out)
+            except Exception as e:
+                log_write("Error", traceback.format_exc())
+            finally:
+                if f is not None:
+                    f.close()
 
     def convert_to_img(self, output_directories, is_gendc, extension, r_gains, g_gains, b_gains, to_delete=True,
-                       rotate_limit=60, time_out=5):
+                       rotate_limit=60, time_out=5, progress_callback=None,
+                       frame_range=None, time_range=None, frame_step=1, niceness=0):
+        # returns whether every selected frame was saved
         payloadsizes = self.dev_info["PayloadSize"]
         num_device = self.dev_info["Number of Devices"]
         pixelformat = self.dev_info["PixelFormat"]
@@ -28,7 +613,7 @@ class Converter:
         height = self.dev_info["Height"]
         if extension == "bin" or extension not in ['bin', 'png', 'jpg', 'jpeg', 'png', 'bmp', 'raw']:
             log_write("ERROR", "extension {} is not supported".format(extension))
-            return
+            return False
         '''CONFIGURATION'''
         is_color = False
         color_pattern = ""
@@ -38,65 +623,130 @@ class Converter:
         num_bit_shift = get_num_bit_shift(pixelformat)
         required_bit = required_bit_depth(pixelformat)
         coef = pow(2, num_bit_shift)
+        if to_delete and (frame_range is not None or time_range is not None or frame_step != 1):
+            log_write("WARNING", "Partial export, the bin files are kept")
+            to_delete = False
 
         if extension != "bin":
-            for i in range(num_device):
+            # shard the work by (device, bin file, frame range), seeking through the frame index
+            device_shards = [[] for i in range(num_device)]
+            shard_length = max(FRAMES_PER_SHARD, self.get_batch_size(is_color, height, width, required_bit,
+                                                                     extension))
+            try:
+                frame_indices = self.get_frame_indices(output_directories, is_gendc, rotate_limit)
+            except Exception as e:
+                log_write("Error", traceback.format_exc())
+                return False
+            for i, frame_index in enumerate(frame_indices):
                 output_directory = output_directories[i]
-                payload_in_byte = payloadsizes[i]
-                try:
-                    file_list = [f for f in os.listdir(output_directory) if f.endswith(".bin")]  # exclude the json file
-                    for file in file_list:
-                        log_write("INFO", "Converting {} file into {}, please wait".format(file, extension))
-                        file_path = os.path.join(output_directory, file)
-
-                        if not is_gendc:
-                            self.convert_single_img_bin_to_image(
-                                file_path,
-                                required_bit,
-                                coef,
-                                output_directory,
-                                height, width, pixelformat,
-                                is_color,
-                                color_pattern,
-                                r_gains[i],
-                                g_gains[i],
-                                b_gains[i],
-                                extension, rotate_limit=rotate_limit)
+                # bytes per frame in the bin file
+                frame_stride = payloadsizes[i] if is_gendc else 4 + width * height * required_bit // 8
+                prefix = get_bin_prefix(is_gendc, i)
+                frame_index = select_frames(frame_index, frame_range, time_range, frame_step,
+                                            self.dev_info["FrameRate"])
+                for file_number, frame_start, frame_stop, step in get_frame_runs(frame_index, frame_stride,
+                                                                                 shard_length):
+                    file_path = os.path.join(output_directory, "{}{}.bin".format(prefix, file_number))
+                    device_shards[i].append((i, file_path, frame_start, frame_stop, step))
+            # devices are interleaved, so that every device makes progress from the start
+            shards = [shard for shards_of_round in itertools.zip_longest(*device_shards) for shard in shards_of_round
+                      if shard is not None]
+
+            remaining_shards = collections.Counter(file_path for i, file_path, *_ in shards)
+            encoded = [[0, 0, 0.0] for i in range(num_device)]  # frames, bytes, encoding seconds
+            # bin files with a frame that wasn't saved and their devices, they keep their bin files and index
+            failed_files = set()
+            failed_devices = set()
+
+            def finish_device(i):
+                # as soon as the last shard of device i is done, independent of the other devices
+                if to_delete and i not in failed_devices:
+                    del_frame_index(output_directories[i], get_bin_prefix(is_gendc, i), time_out)
+                num_frames, num_bytes, busy = encoded[i]
+                if busy > 0:
+                    log_write("DEBUG", "Device {}: {} {} frames, {:.1f} MB, {} encoder {:.1f} fps {:.1f} MB/s "
+                                       "per thread".format(i, num_frames, extension, num_bytes / 1e6,
+                                                           self.image_encoder, num_frames / busy,
+                                                           num_bytes / 1e6 / busy))
+                log_write("DEBUG", "Device {}: Finish saving images in {}".format(i, output_directories[i]))
+                move_to_group(output_directories[i], is_gendc, i, time_out)
+
+            # spawn: don't fork the GUI and its threads
+            with ProcessPoolExecutor(max_workers=self.num_workers, mp_context=multiprocessing.get_context("spawn"),
+                                     initializer=lower_priority, initargs=(niceness,)) as pool:
+                futures = {}
+                for shard in shards:
+                    i, file_path, frame_start, frame_stop, step = shard
+                    output_directory = output_directories[i]
+                    if not is_gendc:
+                        futures[pool.submit(
+                            self.convert_single_img_bin_to_image,
+                            file_path,
+                            required_bit,
+                            coef,
+                            output_directory,
+                            height, width, pixelformat,
+                            is_color,
+                            color_pattern,
+                            r_gains[i],
+                            g_gains[i],
+                            b_gains[i],
+                            extension, rotate_limit=rotate_limit,
+                            frame_start=frame_start, frame_stop=frame_stop, frame_step=step)] = shard
+                    else:
+                        futures[pool.submit(
+                            self.convert_single_gendc_bin_to_image,
+                            file_path,
+                            required_bit,
+                            coef,
+                            output_directory,
+                            height, width, payloadsizes[i],
+                            is_color,
+                            color_pattern,
+                            r_gains[i],
+                            g_gains[i],
+                            b_gains[i],
+                            extension, rotate_limit=rotate_limit,
+                            frame_start=frame_start, frame_stop=frame_stop, frame_step=step)] = shard
+
+                done_shards = [0] * num_device
+                for i in range(num_device):
+                    if len(device_shards[i]) == 0:
+                        finish_device(i)
+                for future in as_completed(futures):
+                    i, file_path, frame_start, frame_stop, step = futures[future]
+                    try:
+                        num_frames, num_bytes, busy, num_failed = future.result()
+                    except Exception as e:
+                        log_write("Error", "Device {}: converting frames {}-{} of {} failed: {}".format(
+                            i, frame_start, frame_stop - 1, file_path, e))
+                        failed_files.add(file_path)
+                        failed_devices.add(i)
+                    else:
+                        for k, value in enumerate((num_frames, num_bytes, busy)):
+                            encoded[i][k] += value
+                        # every frame of the shard in the index must have been saved
+                        num_expected = len(range(frame_start, frame_stop, step))
+                        if num_failed > 0 or num_frames != num_expected:
+                            log_write("Error", "Device {}: saved {} of {} frames {}-{} of {}".format(
+                                i, num_frames, num_expected, frame_start, frame_stop - 1, file_path))
+                            failed_files.add(file_path)
+                            failed_devices.add(i)
+                    remaining_shards[file_path] -= 1
+                    if remaining_shards[file_path] == 0:
+                        if file_path in failed_files:
+                            log_write("WARNING", "Device {}: {} is not fully converted into {}, it is kept".format(
+                                i, file_path, extension))
                         else:
-                            self.convert_single_gendc_bin_to_image(
-                                file_path,
-                                required_bit,
-                                coef,
-                                output_directory,
-                                height, width, payload_in_byte,
-                                is_color,
-                                color_pattern,
-                                r_gains[i],
-                                g_gains[i],
-                                b_gains[i],
-                                extension, rotate_limit=rotate_limit)
-                        if to_delete:
-                            del_bin(file_path, time_out)
-                    log_write("DEBUG", "Device {}: Finish saving images in {}".format(i, output_directory))
-                except Exception as e:
-                    log_write("Error", traceback.format_exc())
-
-        prefix_name0 = DEFAULT_GENDC_PREFIX_NAME0 if is_gendc else DEFAULT_PREFIX_NAME0
-        prefix_name1 = DEFAULT_GENDC_PREFIX_NAME1 if is_gendc else DEFAULT_PREFIX_NAME1
-
-        for i in range(num_device):
-            output_directory = output_directories[i]
-            if i == 0:
-                sensor_info = read_config(os.path.join(output_directory, prefix_name0 + "config.json"), time_out)
-            else:
-                sensor_info = read_config(os.path.join(output_directory, prefix_name1 + "config.json"), time_out)
-            if len(sensor_info) == 0:
-                log_write("WARNING", "Cannot found config file")
-                continue
-            group_id = sensor_info["group_id"]
-            log_write("DEBUG", "Device {}: Group-id is {}".format(i, group_id))
-            if group_id != 0:
-                shutil.move(output_directory, output_directory.replace("group0", "group{}".format(group_id)))
+                            log_write("INFO", "Device {}: converted {} into {}".format(i, file_path, extension))
+                            if to_delete:
+                                del_bin(file_path, time_out)
+                    done_shards[i] += 1
+                    if progress_callback is not None:
+                        progress_callback(i, done_shards[i], len(device_shards[i]))
+                    if done_shards[i] == len(device_shards[i]):
+                        finish_device(i)
+            return len(failed_files) == 0
 
     def convert_single_img_bin_to_image(self,
                                         file_path,
@@ -109,63 +759,16 @@ class Converter:
                                         r_gain=1.0,
                                         g_gain=1.0,
                                         b_gain=1.0,
-                                        extension="jpg", rotate_limit=60):
-        cursor = 0
-        img_size = width * height
-        image_payload_byte = img_size
-        with open(file_path, mode='rb') as f:
-            if required_bit_depth(pixelformat) == 8:
-                d = np.fromfile(f, dtype=np.uint8)
-                image_payload_byte *= 1
-            elif required_bit_depth(pixelformat) == 16:
-                d = np.fromfile(f, dtype=np.uint16)
-                image_payload_byte *= 2
-            else:
-                log_write("Error", "PixelFormat: {} is not supported".format(pixelformat))
-                return
-            file_size_in_byte = len(d) * required_bit // 8
-            offset = 0
-            slide = 32 // required_bit
-            for i in range(rotate_limit):
-                if cursor >= file_size_in_byte:
-                    break
-                f.seek(cursor)
-                frame_id = np.fromfile(f, dtype=np.uint32, count=1)
-                cursor += 4
-                offset += slide
-                if len(frame_id) > 0:
-                    frame_id = frame_id[0]
-                else:
-                    break
-                img_arr = d[offset:offset + img_size]
-                offset = offset + img_size
-                cursor = cursor + image_payload_byte
-                if img_arr.size == img_size:
-                    if extension == 'raw':
-                        img_arr.tofile(os.path.join(output_directory, str(frame_id) + "." + extension))
-                    else:
-                        img_arr = img_arr * coef
-                        img_arr = img_arr.reshape((height, width))
-                        if required_bit == 16 and extension != "png":
-                            img_arr = (img_arr / 256).clip(0, 255).astype("uint8")  # convert to 8 bit 0 ~ 255
-                        if is_color:
-                            if color_pattern == "BGGR":
-                                img_arr = cv2.cvtColor(img_arr, cv2.COLOR_BayerBGGR2RGB)  # transfer Bayer to RGB
-                            elif color_pattern == "RGGB":
-                                img_arr = cv2.cvtColor(img_arr, cv2.COLOR_BayerRGGB2RGB)  # transfer Bayer to RGB
-                            img_normalized = cv2.normalize(img_arr, None, 0, 1.0, cv2.NORM_MINMAX, dtype=cv2.CV_32F)
-                            (R, G, B) = cv2.split(img_normalized)
-                            R = (R * r_gain).clip(0, 1)
-                            G = (G * g_gain).clip(0, 1)
-                            B = (B * b_gain).clip(0, 1)
-                            img_float32 = cv2.merge([R, G, B])
-                            img_arr = (img_float32 * 255).astype(np.uint8)  # convert to 8 bit 0 ~ 255
-
-                        # Make into PIL Image and save
-                        PILimage = Image.fromarray(img_arr)
-                        PILimage.save(os.path.join(output_directory, str(frame_id) + "." + extension))
-                else:
-                    log_write("Warning", "Incomplete image-{}".format(str(frame_id)))
+                                        extension="jpg", rotate_limit=60, frame_start=0, frame_stop=None,
+                                        frame_step=1):
+        # every frame_step-th frame of [frame_start, frame_stop) of the file
+        batch_size = self.get_batch_size(is_color, height, width, required_bit, extension)
+        batches = self.iter_bin_batches(file_path, False, required_bit, height, width, None, pixelformat, rotate_limit,
+                                        frame_start, frame_stop, frame_step, batch_size)
+        return self.convert_frames(batches, self.get_image_sink(output_directory, extension),
+                                   self.get_frame_process(extension, coef, required_bit, is_color, color_pattern,
+                                                          r_gain, g_gain, b_gain,
+                                                          bgr=self.image_encoder == "cv2"))
 
     def convert_single_gendc_bin_to_image(self,
                                           file_path,
@@ -178,61 +781,16 @@ class Converter:
                                           r_gain=1.0,
                                           g_gain=1.0,
                                           b_gain=1.0,
-                                          extension="jpg", rotate_limit=60):
-        cursor = 0
-        with open(file_path, mode='rb') as f:
-            filecontent = f.read()
-            for i in range(rotate_limit):
-                if cursor >= len(filecontent):
-                    break
-                try:
-                    gendc_container = gendc.Container(filecontent[cursor:])
-                    # get GenDC container information
-                    # get first available image component
-                    image_component_idx = gendc_container.get_1st_component_idx_by_typeid(GDC_INTENSITY)
-                    if image_component_idx != -1:
-                        image_component = gendc_container.get_component_by_index(image_component_idx)
-                        part = image_component.get_part_by_index(0)
-                        # Access to Comp 0, Part 0's TypeSpecific 3 (where typespecific count start with 1; therefore, index is 2)
-                        typespecific3 = part.get_typespecific_by_index(2)
-                        # Access to the first 4-byte of typespecific3
-                        frame_id = int.from_bytes(typespecific3.to_bytes(8, 'little')[0:4], "little")
-                        if required_bit == 8:
-                            img_arr = np.frombuffer(part.get_data(), dtype=np.uint8)
-                        elif required_bit == 16:
-                            img_arr = np.frombuffer(part.get_data(), dtype=np.uint16)
-
-                        if img_arr.size == width * height:
-                            if extension == 'raw':
-                                img_arr.tofile(os.path.join(output_directory, str(frame_id) + "." + extension))
-                            else:
-                                img_arr = img_arr * coef
-                                img_arr = img_arr.reshape((height, width))
-                                if required_bit == 16 and extension != "png":
-                                    img_arr = (img_arr / 256).clip(0, 255).astype("uint8")  # convert to 8 bit
-                                if is_color:
-                                    if color_pattern == "BGGR":
-                                        img_arr = cv2.cvtColor(img_arr, cv2.COLOR_BayerBGGR2RGB)  # transfer Bayer to RGB
-                                    elif color_pattern == "RGGB":
-                                        img_arr = cv2.cvtColor(img_arr, cv2.COLOR_BayerRGGB2RGB)  # transfer Bayer to RGB
-
-                                    img_normalized = cv2.normalize(img_arr, None, 0, 1.0, cv2.NORM_MINMAX,
-                                                                   dtype=cv2.CV_32F)
-                                    (R, G, B) = cv2.split(img_normalized)
-                                    R = (R * r_gain).clip(0, 1)
-                                    G = (G * g_gain).clip(0, 1)
-                                    B = (B * b_gain).clip(0, 1)
-                                    img_float32 = cv2.merge([R, G, B])
-                                    img_arr = (img_float32 * 255).astype(np.uint8)  # convert to 8 bit 0 ~ 255
-
-                                PILimage = Image.fromarray(img_arr)
-                                PILimage.save(os.path.join(output_directory, str(frame_id) + "." + extension))
-                        else:
-                            log_write("Warning", "Incomplete image-{}".format(str(frame_id)))
-                except Exception as e:
-                    log_write("ERROR", "convert single frame in {} failed : {}".format(file_path, e))
-                finally:
-                    cursor = cursor + payload_in_byte
+                                          extension="jpg", rotate_limit=60, frame_start=0, frame_stop=None,
+                                          frame_step=1):
+        # every frame_step-th frame of [frame_start, frame_stop) of the file
+        batch_size = self.get_batch_size(is_color, height, width, required_bit, extension)
+        batches = self.iter_bin_batches(file_path, True, required_bit, height, width, payload_in_byte, None,
+                                        rotate_limit, frame_start, frame_stop, frame_step, batch_size)
+        return self.convert_frames(batches, self.get_image_sink(output_directory, extension),
+                                   self.get_frame_process(extension, coef, required_bit, is_color, color_pattern,
+                                                          r_gain, g_gain, b_gain,
+                                                          bgr=self.image_encoder == "cv2"))
 
     def convert_to_video(self,
                          output_directories,
@@ -242,9 +800,12 @@ class Converter:
                          b_gains,
                          to_delete=True,
                          rotate_limit=60,
-                         time_out=5):  # time_out is 5 s
-
-        video_writers = []
+                         time_out=5,  # time_out is 5 s
+                         frame_range=None,
+                         time_range=None,
+                         frame_step=1,
+                         progress_callback=None):
+        # returns whether the video of every device was written
         payloadsizes = self.dev_info["PayloadSize"]
         num_device = self.dev_info["Number of Devices"]
         pixel_format = self.dev_info["PixelFormat"]
@@ -260,26 +821,25 @@ class Converter:
         num_bit_shift = get_num_bit_shift(pixel_format)
         coef = pow(2, num_bit_shift)
         required_bit = required_bit_depth(pixel_format)
+        if to_delete and (frame_range is not None or time_range is not None or frame_step != 1):
+            log_write("WARNING", "Partial export, the bin files are kept")
+            to_delete = False
+        try:
+            frame_indices = self.get_frame_indices(output_directories, is_gendc, rotate_limit)
+        except Exception as e:
+            log_write("WARNING", traceback.format_exc())
+            return False
 
-        for i in range(num_device):
+        def encode_device(i, color_pool):
             output_directory = output_directories[i]
             payload_in_byte = payloadsizes[i]
+            out = None
             try:
-                file_list = [f for f in os.listdir(output_directory) if f.endswith(".bin")]  # exclude the json file
-                # sort
-                if not is_gendc:
-                    file_list.sort(
-                        key=lambda f: int(
-                            f.replace(DEFAULT_PREFIX_NAME0, "").replace(DEFAULT_PREFIX_NAME1, "").replace('.bin', "")))
-                else:
-                    file_list.sort(
-                        key=lambda f: int(
-                            f.replace(DEFAULT_GENDC_PREFIX_NAME0, "").replace(DEFAULT_GENDC_PREFIX_NAME1, "").replace(
-                                '.bin', "")))
+                file_list = list_bin_files(output_directory)
 
                 if len(file_list) == 0:
                     log_write("WARNING", "No bin file exists")
-                    continue
+                    return False
                 fourcc = cv2.VideoWriter_fourcc('m', 'p', '4', 'v')
 
                 if is_color: # bayerBG
@@ -296,191 +856,362 @@ class Converter:
                                                                    cv2.VIDEOWRITER_PROP_IS_COLOR,
                                                                    0,  # false
                                                                    ], )
+                if not out.isOpened():
+                    log_write("ERROR", "Device {}: cannot open a video writer in {}".format(i, output_directory))
+                    return False
                 out.set(cv2.VIDEOWRITER_PROP_QUALITY, 100)
-                video_writers.append(out)
 
-                for file in file_list:
-                    log_write("INFO", "Converting {} file into mp4, please wait".format(file))
-                    file_path = os.path.join(output_directory, file)
+                file_paths = [os.path.join(output_directory, file) for file in file_list]
+                # only the selected frames are read, seeking through the frame index
+                prefix = get_bin_prefix(is_gendc, i)
+                frame_stride = payload_in_byte if is_gendc else 4 + width * height * required_bit // 8
+                frame_index = select_frames(frame_indices[i], frame_range, time_range, frame_step, fps)
+                runs = [(os.path.join(output_directory, "{}{}.bin".format(prefix, file_number)), start, stop, step)
+                        for file_number, start, stop, step in get_frame_runs(frame_index, frame_stride)]
+                batch_size = self.get_batch_size(is_color, height, width, required_bit, "mp4")
+                batches = (batch for file_path, start, stop, step in runs
+                           for batch in self.iter_bin_batches(file_path, is_gendc, required_bit, height, width,
+                                                              payload_in_byte, pixel_format, rotate_limit,
+                                                              start, stop, step, batch_size))
+                log_write("INFO", "Device {}: Converting {} frames into mp4, please wait".format(i, len(frame_index)))
+                # shared by the color_pool threads, so every frame gets its own output buffer
+                process = self.get_frame_process("mp4", coef, required_bit, is_color, color_pattern,
+                                                 r_gains[i], g_gains[i], b_gains[i], bgr=True)
+                progress = None if progress_callback is None else \
+                    functools.partial(progress_callback, i, total=len(frame_index))
+                stats = self.encode_video(VideoSink(out), batches, color_pool, process, batch_size, progress)
+                log_write("DEBUG", "Device {}: {} frames, read {:.1f} fps, color {:.1f} fps, write {:.1f} fps".format(
+                    i, *stats))
+                # like the image path, the recording is kept unless every selected frame was encoded
+                if stats[0] != len(frame_index):
+                    log_write("Error", "Device {}: encoded {} of {} frames, the bin files are kept".format(
+                        i, stats[0], len(frame_index)))
+                    return False
 
-                    if not is_gendc:
-                        self.convert_single_img_bin_to_video(out,
-                                                             file_path,
-                                                             required_bit,
-                                                             coef,
-                                                             height, width, pixel_format,
-                                                             is_color,
-                                                             color_pattern,
-                                                             r_gains[i],
-                                                             g_gains[i],
-                                                             b_gains[i],
-                                                             rotate_limit)
-
-
-                    else:
-                        self.convert_single_gendc_bin_to_video(out,
-                                                               file_path,
-                                                               required_bit,
-                                                               coef,
-                                                               height, width, payload_in_byte,
-                                                               is_color,
-                                                               color_pattern,
-                                                               r_gains[i],
-                                                               g_gains[i],
-                                                               b_gains[i],
-                                                               rotate_limit)
-
-                    if to_delete:
+                if to_delete:
+                    for file_path in file_paths:
                         del_bin(file_path, time_out)
+                    del_frame_index(output_directory, get_bin_prefix(is_gendc, i), time_out)
 
                 log_write("DEBUG", "Device {}: Finish saving video in {}".format(i, output_directory))
+                return True
 
             except Exception as e:
                 log_write("WARNING", traceback.format_exc())
+                return False
             finally:
-                for writer in video_writers:
-                    writer.release()
+                if out is not None:
+                    out.release()
 
-        prefix_name0 = DEFAULT_GENDC_PREFIX_NAME0 if is_gendc else DEFAULT_PREFIX_NAME0
-        prefix_name1 = DEFAULT_GENDC_PREFIX_NAME1 if is_gendc else DEFAULT_PREFIX_NAME1
+        def convert_device(i, color_pool):
+            succeeded = encode_device(i, color_pool)
+            # as soon as device i is done, independent of the other devices
+            move_to_group(output_directories[i], is_gendc, i, time_out)
+            return succeeded
 
-        for i in range(num_device):
-            output_directory = output_directories[i]
-            if i == 0:
-                sensor_info = read_config(os.path.join(output_directory, prefix_name0 + "config.json"), time_out)
-            else:
-                sensor_info = read_config(os.path.join(output_directory, prefix_name1 + "config.json"), time_out)
-            if len(sensor_info) == 0:
-                log_write("WARNING", "Cannot found config file")
-                continue
-            group_id = sensor_info["group_id"]
-            log_write("DEBUG", "Group-id is {}".format(group_id))
-            if group_id != 0:
-                shutil.move(output_directory, output_directory.replace("group0", "group{}".format(group_id)))
+        # devices are encoded concurrently and share the color stage workers
+        with ThreadPoolExecutor(max_workers=self.num_workers) as color_pool:
+            with ThreadPoolExecutor(max_workers=num_device) as device_pool:
+                futures = [device_pool.submit(convert_device, i, color_pool) for i in range(num_device)]
+                return all([future.result() for future in futures])
 
-    def convert_single_gendc_bin_to_video(self, video_writer,
-                                          file_path,
-                                          required_bit,
-                                          coef,
-                                          height, width, payload_in_byte,
-                                          is_color,
-                                          color_pattern,
-                                          r_gain=1.0,
-                                          g_gain=1.0,
-                                          b_gain=1.0,
-                                          rotate_limit=60):
+    def encode_video(self, sink, batches, color_pool, process, batch_size=1, progress=None):
+        # reader thread -> bounded queue -> process on color_pool -> in-order sink (this thread)
+        # progress(number of frames written) after every batch
+        # returns (number of frames, read fps, color fps, write fps), fps measured over each stage's busy time
+        max_in_flight = max(2, VIDEO_QUEUE_SIZE // batch_size)  # batches, about VIDEO_QUEUE_SIZE frames
+        batch_queue = queue.Queue(maxsize=max_in_flight)
+        busy = {"read": 0.0, "color": 0.0, "write": 0.0}
+        written = [0]
+        lock = threading.Lock()
+        stop = threading.Event()  # set when this thread fails, the reader quits after its current batch
+        read_errors = []  # exception of the reader, re-raised here once it has stopped
 
-        cursor = 0
-        with open(file_path, mode='rb') as f:
-            filecontent = f.read()
-            for i in range(rotate_limit):
-                if cursor >= len(filecontent):
+        def read_batches():
+            try:
+                start = time.perf_counter()
+                for frame_ids, img_stack in batches:
+                    busy["read"] += time.perf_counter() - start
+                    batch_queue.put((frame_ids, img_stack))
+                    if stop.is_set():
+                        break
+                    start = time.perf_counter()
+            except Exception as e:
+                read_errors.append(e)
+            finally:
+                batch_queue.put(None)
+
+        def color_batch(img_stack):
+            start = time.perf_counter()
+            img_stack = process(img_stack)
+            with lock:
+                busy["color"] += time.perf_counter() - start
+            return img_stack
+
+        def write_batch(item):
+            frame_ids, future = item
+            img_stack = future.result()
+            start = time.perf_counter()
+            for frame_id, img_arr in zip(frame_ids, img_stack):
+                sink.write(frame_id, img_arr)
+            busy["write"] += time.perf_counter() - start
+            written[0] += len(frame_ids)
+            if progress is not None:
+                progress(written[0])
+
+        reader = threading.Thread(target=read_batches)
+        reader.start()
+        num_frames = 0
+        in_flight = collections.deque()  # in reading order, so frames are written in frame_id order
+        try:
+            while True:
+                item = batch_queue.get()
+                if item is None:
                     break
+                in_flight.append((item[0], color_pool.submit(color_batch, item[1])))
+                num_frames += len(item[0])
+                if len(in_flight) >= max_in_flight:
+                    write_batch(in_flight.popleft())
+            while in_flight:
+                write_batch(in_flight.popleft())
+        except BaseException:
+            stop.set()
+            for frame_ids, future in in_flight:
+                future.cancel()
+            # the reader may be waiting on the full queue
+            while reader.is_alive():
                 try:
-                    gendc_container = gendc.Container(filecontent[cursor:])
-                    # get GenDC container information
-                    # get first available image component
-                    image_component_idx = gendc_container.get_1st_component_idx_by_typeid(GDC_INTENSITY)
-                    if image_component_idx != -1:
-                        image_component = gendc_container.get_component_by_index(image_component_idx)
-                        part = image_component.get_part_by_index(0)
-                        # Access to Comp 0, Part 0's TypeSpecific 3 (where typespecific count start with 1; therefore, index is 2)
-                        typespecific3 = part.get_typespecific_by_index(2)
-                        # Access to the first 4-byte of typespecific3
-                        frame_id = int.from_bytes(typespecific3.to_bytes(8, 'little')[0:4], "little")
-                        if required_bit == 8:
-                            img_arr = np.frombuffer(part.get_data(), dtype=np.uint8)
-                        elif required_bit == 16:
-                            img_arr = np.frombuffer(part.get_data(), dtype=np.uint16)
-
-                        if img_arr.size == width * height:
-                            img_arr = img_arr * coef
-                            img_arr = img_arr.reshape((height, width))
-                            if is_color:
-                                if color_pattern == "BGGR":
-                                    img_arr = cv2.cvtColor(img_arr, cv2.COLOR_BayerBGGR2BGR)  # transfer Bayer to RGB
-                                elif color_pattern == "RGGB":
-                                    img_arr = cv2.cvtColor(img_arr, cv2.COLOR_BayerRGGB2BGR)  # transfer Bayer to RGB
-                                img_normalized = cv2.normalize(img_arr, None, 0, 1.0, cv2.NORM_MINMAX, dtype=cv2.CV_32F)
-                                (B, G, R) = cv2.split(img_normalized)
-                                R = (R * r_gain).clip(0, 1)
-                                G = (G * g_gain).clip(0, 1)
-                                B = (B * b_gain).clip(0, 1)
-                                img_float32 = cv2.merge([B, G, R])
-                                img_arr = (img_float32 * 255).astype(np.uint8)  # convert to 8 bit 0 ~ 255
-
-                            video_writer.write(img_arr)
-                        else:
-                            log_write("Warning", "Incomplete frame-{}".format(str(frame_id)))
-                except Exception as e:
-                    log_write("ERROR", "convert single frame in {} failed : {}".format(file_path, e))
-                finally:
-                    cursor = cursor + payload_in_byte
+                    batch_queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            raise
+        finally:
+            reader.join()
+        if read_errors:
+            raise read_errors[0]
 
-    def convert_single_img_bin_to_video(self, video_writer,
-                                        file_path,
-                                        required_bit,
-                                        coef,
-                                        height, width, pixel_format,
-                                        is_color,
-                                        color_pattern,
-                                        r_gain=1.0,
-                                        g_gain=1.0,
-                                        b_gain=1.0,
-                                        rotate_limit=60):
-
-        # bin file is in 2D
-
-        img_size = width * height
-        position = 0
-        image_payload_byte = img_size
-        with open(file_path, mode='rb') as f:
-            if required_bit == 8:
-                d = np.fromfile(f, dtype=np.uint8)
-            elif required_bit == 16:
-                d = np.fromfile(f, dtype=np.uint16)
-                image_payload_byte = img_size * 2
-            else:
-                log_write("Error", "PixelFormat: {} is not supported".format(pixel_format))
-                return
-            file_size_in_byte = len(d) * required_bit // 8
-            offset = 0
-            slide = 32 // required_bit
-            for i in range(rotate_limit):
-                if file_size_in_byte < position:
-                    break
-                f.seek(position)
-                frame_id = np.fromfile(f, dtype=np.uint32, count=1)
-                position += 4
-                offset += slide
-                if len(frame_id) > 0:
-                    frame_id = frame_id[0]
-                else:
-                    break
-                img_arr = d[offset:offset + img_size]
-                offset = offset + img_size
-                position = position + image_payload_byte
-                if img_arr.size == img_size:
-                    img_arr = img_arr * coef
-                    img_arr = img_arr.reshape((height, width))
-                    if is_color:
-                        if color_pattern == "BGGR":
-                            img_arr = cv2.cvtColor(img_arr, cv2.COLOR_BayerBGGR2BGR)  # transfer Bayer to RGB
-                        elif color_pattern == "RGGB":
-                            img_arr = cv2.cvtColor(img_arr, cv2.COLOR_BayerRGGB2BGR)  # transfer Bayer to RGB
-                        img_normalized = cv2.normalize(img_arr, None, 0, 1.0, cv2.NORM_MINMAX, dtype=cv2.CV_32F)
-                        (B, G, R) = cv2.split(img_normalized)
-                        R = (R * r_gain).clip(0, 1)
-                        G = (G * g_gain).clip(0, 1)
-                        B = (B * b_gain).clip(0, 1)
-                        img_float32 = cv2.merge([B, G, R])
-                        img_arr = (img_float32 * 255).astype(np.uint8)  # convert to 8 bit 0 ~ 255
-
-                    video_writer.write(img_arr)
+        return (num_frames,) + tuple(num_frames / busy[stage] if busy[stage] > 0 else 0.0
+                                     for stage in ("read", "color", "write"))
+
+    def get_batch_size(self, is_color, height, width, required_bit, extension):
+        # only the 16 -> 8 bit reduction gains from stacks, a shift alone is slower over a stack than frame by frame
+        if is_color or not is_reduced_to_8bit(required_bit, extension):
+            return 1
+        return min(self.batch_size, max(1, MAX_BATCH_BYTES // (height * width * required_bit // 8)))
+
+    def get_image_sink(self, output_directory, extension):
+        return ImageSink(output_directory, extension, self.image_encoder, self.png_compression, self.jpeg_quality,
+                         self.encoding_threads)
+
+    def get_frame_process(self, extension, coef, required_bit, is_color, color_pattern,
+                          r_gain=1.0, g_gain=1.0, b_gain=1.0, bgr=False):
+        # processing stage for one output format, None for raw which keeps the bin file pixels
+        if extension == "raw":
+            return None
+        color_stage = ColorStage(color_pattern, r_gain, g_gain, b_gain, bgr=bgr) if is_color else None
+        to_8bit = is_reduced_to_8bit(required_bit, extension)
+        return functools.partial(self.process_batch, num_bit_shift=coef.bit_length() - 1, color_stage=color_stage,
+                                 to_8bit=to_8bit)
+
+    def process_batch(self, img_stack, num_bit_shift, color_stage=None, to_8bit=False):
+        # (n, height, width) frames, every step is one vectorized call over the whole stack
+        if to_8bit:
+            # (value << num_bit_shift) >> 8 on the wrapped uint16 value, straight into 8 bit 0 ~ 255
+            img_8bit = np.empty(img_stack.shape, dtype=np.uint8)
+            img_stack = np.right_shift(img_stack, 8 - num_bit_shift, out=img_8bit, casting="unsafe")
+        elif num_bit_shift > 0:
+            # a multiply, the uint16 left_shift is slower
+            img_stack = img_stack * (1 << num_bit_shift)
+        if color_stage is not None:
+            # transfer Bayer to RGB (BGR for mp4), white balanced 8 bit 0 ~ 255
+            return [color_stage(img_arr) for img_arr in img_stack]
+        return img_stack
+
+    def convert_frames(self, batches, sink, process=None):
+        # (frame_ids, (n, height, width) frames) batches -> process -> ImageSink
+        # returns (frames saved, bytes, encoding seconds, frames that failed)
+        num_failed = 0
+        for frame_ids, img_stack in batches:
+            try:
+                for frame_id, img_arr in zip(frame_ids, img_stack if process is None else process(img_stack)):
+                    sink.write(frame_id, img_arr)
+            except Exception as e:
+                log_write("ERROR", "convert frame {}-{} failed : {}".format(frame_ids[0], frame_ids[-1], e))
+                num_failed += len(frame_ids)
+        num_frames, num_bytes, busy, num_errors = sink.close()
+        return num_frames, num_bytes, busy, num_failed + num_errors
+
+    def iter_bin_batches(self, file_path, is_gendc, required_bit, height, width, payload_in_byte, pixel_format,
+                         rotate_limit=60, frame_start=0, frame_stop=None, frame_step=1, batch_size=1):
+        # yields (frame_ids, (n, height, width) frames) of up to batch_size frames from either bin file format
+        if required_bit not in (8, 16):
+            log_write("Error", "PixelFormat: {} is not supported".format(pixel_format))
+            return
+        frame_stop = rotate_limit if frame_stop is None else min(frame_stop, rotate_limit)
+        if not is_gendc:
+            with BinFrameReader(file_path, height, width, required_bit) as reader:
+                yield from reader.batches(frame_start, frame_stop, frame_step, batch_size)
+            return
+        frames = self.iter_gendc_bin_frames(file_path, required_bit, height, width, payload_in_byte, rotate_limit,
+                                            frame_start, frame_stop, frame_step)
+        while True:
+            batch = list(itertools.islice(frames, batch_size))
+            if not batch:
+                break
+            yield [frame_id for frame_id, img_arr in batch], np.stack([img_arr for frame_id, img_arr in batch])
+
+    def iter_gendc_bin_frames(self, file_path, required_bit, height, width, payload_in_byte, rotate_limit=60,
+                              frame_start=0, frame_stop=None, frame_step=1):
+        # yields (frame_id, 2D image) for every complete frame in the file
+        with GenDCFrameReader(file_path, payload_in_byte) as reader:
+            frame_stop = rotate_limit if frame_stop is None else min(frame_stop, rotate_limit)
+            for frame_id, image_component, data in reader.frames(frame_start, frame_stop, frame_step):
+                if required_bit == 8:
+                    img_arr = np.frombuffer(data, dtype=np.uint8)
+                elif required_bit == 16:
+                    img_arr = np.frombuffer(data, dtype=np.uint16)
+
+                if img_arr.size == width * height:
+                    yield frame_id, img_arr.reshape((height, width))
                 else:
                     log_write("Warning", "Incomplete frame-{}".format(str(frame_id)))
 
 
+class ConversionJob:
+    # one finished recording waiting for or in conversion, status: queued, converting, done, failed or cancelled
+    def __init__(self, name, output_directories, is_gendc, extension, r_gains, g_gains, b_gains, to_delete):
+        self.name = name
+        # copies, the GUI reuses its lists for the next recording
+        self.output_directories = list(output_directories)
+        self.is_gendc = is_gendc
+        self.extension = extension
+        self.r_gains, self.g_gains, self.b_gains = list(r_gains), list(g_gains), list(b_gains)
+        self.to_delete = to_delete
+        self.status = "queued"
+        self.device_progress = {}
+
+    def update_progress(self, device, done, total):
+        self.device_progress[device] = done / total if total > 0 else 1.0
+
+    @property
+    def progress(self):
+        # 0 ~ 1, average of the devices
+        if self.status == "done":
+            return 1.0
+        return sum(self.device_progress.values()) / len(self.output_directories)
+
+
+class ConversionQueue:
+    # converts finished recordings in the background, jobs run in submission order on num_workers threads
+    # the work itself runs in spawned processes, so it doesn't compete for the GIL with capture and preview
+    def __init__(self, converter, num_workers=1, niceness=10):
+        self.converter = converter
+        # conversion processes run at a lower priority than capture and preview
+        self.niceness = niceness
+        self.jobs = []  # every job of the session, for progress display
+        self.pending = queue.Queue()
+        self.workers = [threading.Thread(target=self.run) for i in range(num_workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, name, output_directories, is_gendc, extension, r_gains, g_gains, b_gains, to_delete):
+        job = ConversionJob(name, output_directories, is_gendc, extension, r_gains, g_gains, b_gains, to_delete)
+        self.jobs.append(job)
+        self.pending.put(job)
+        log_write("INFO", "Queued conversion of {} into {}".format(name, extension))
+        return job
+
+    def run(self):
+        while True:
+            job = self.pending.get()
+            if job is None:
+                break
+            job.status = "converting"
+            try:
+                job.status = "done" if self.convert(job) else "failed"
+                if job.status == "failed":
+                    log_write("Error", "Conversion of {} into {} failed".format(job.name, job.extension))
+            except Exception as e:
+                log_write("Error", traceback.format_exc())
+                job.status = "failed"
+
+    def convert(self, job):
+        # returns whether the whole recording was converted
+        if job.extension == "mp4":
+            return self.convert_to_video(job)
+        elif job.extension != "bin":
+            return self.converter.convert_to_img(job.output_directories, job.is_gendc, job.extension,
+                                                 job.r_gains, job.g_gains, job.b_gains, to_delete=job.to_delete,
+                                                 progress_callback=job.update_progress, niceness=self.niceness)
+        else:
+            # keep the raw recording seekable for later partial exports
+            self.converter.get_frame_indices(job.output_directories, job.is_gendc)
+            return True
+
+    def convert_to_video(self, job):
+        # encodes in a spawned process, the colour stage threads of convert_to_video would hold the GIL here
+        context = multiprocessing.get_context("spawn")
+        messages = context.Queue()
+        process = context.Process(target=convert_to_video_in_process,
+                                  args=(self.converter, job.output_directories, job.is_gendc, job.r_gains,
+                                        job.g_gains, job.b_gains, job.to_delete, self.niceness, messages))
+        process.start()
+        try:
+            while True:
+                # checked before waiting, so a result sent just before the exit is still received
+                alive = process.is_alive()
+                try:
+                    message = messages.get(timeout=1)
+                except queue.Empty:
+                    if not alive:
+                        log_write("Error", "Conversion process of {} exited with {}".format(job.name,
+                                                                                          process.exitcode))
+                        return False
+                    continue
+                if message[0] == "progress":
+                    job.update_progress(*message[1:])
+                else:
+                    return message[1]
+        finally:
+            process.join()
+
+    def close(self):
+        # the running jobs finish, queued ones are dropped and keep their bin files
+        try:
+            while True:
+                job = self.pending.get_nowait()
+                if job is not None:
+                    job.status = "cancelled"
+                    log_write("WARNING", "Conversion of {} cancelled, its bin files are kept".format(job.name))
+        except queue.Empty:
+            pass
+        for worker in self.workers:
+            self.pending.put(None)
+
+
+def convert_to_video_in_process(converter, output_directories, is_gendc, r_gains, g_gains, b_gains, to_delete,
+                                niceness, messages):
+    # target of the ConversionQueue video process, sends ("progress", device, done, total) and ("done", succeeded)
+    lower_priority(niceness)
+
+    def send_progress(device, done, total):
+        messages.put(("progress", device, done, total))
+
+    try:
+        succeeded = converter.convert_to_video(output_directories, is_gendc, r_gains, g_gains, b_gains,
+                                               to_delete=to_delete, progress_callback=send_progress)
+    except Exception as e:
+        log_write("Error", traceback.format_exc())
+        succeeded = False
+    messages.put(("done", succeeded))
+
+
+def lower_priority(niceness):
+    # initializer of conversion processes, niceness is not supported on Windows
+    if niceness > 0 and hasattr(os, "nice"):
+        os.nice(niceness)
+
+
 def del_bin(file_path, time_out):
     try:
         os.remove(file_path)
@@ -488,6 +1219,28 @@ def del_bin(file_path, time_out):
         log_write("ERROR", "failed to delete {}".format(file_path))
 
 
+def del_frame_index(output_directory, prefix, time_out):
+    index_path = os.path.join(output_directory, prefix + FRAME_INDEX_NAME)
+    if os.path.exists(index_path):
+        del_bin(index_path, time_out)
+
+
+def move_to_group(output_directory, is_gendc, i, time_out):
+    # camera directory of device i -> groupN of its config.json
+    try:
+        sensor_info = read_config(os.path.join(output_directory, get_bin_prefix(is_gendc, i) + "config.json"),
+                                  time_out)
+        if len(sensor_info) == 0:
+            log_write("WARNING", "Cannot found config file")
+            return
+        group_id = sensor_info["group_id"]
+        log_write("DEBUG", "Device {}: Group-id is {}".format(i, group_id))
+        if group_id != 0:
+            shutil.move(output_directory, output_directory.replace("group0", "group{}".format(group_id)))
+    except Exception as e:
+        log_write("Error", traceback.format_exc())
+
+
 def read_config(file_path, time_out):
     start = time.time()
     succeed = False
@@ -508,12 +1261,73 @@ def read_config(file_path, time_out):
 
 
 if __name__ == "__main__":
-    converter = Converter({"PayloadSize": [2074880],
-                           "Number of Devices": 1,
-                           "PixelFormat": "Mono12",
-                           "Width": 1920,
-                           "Height": 1080,
-                           "FrameRate": 60
-                           }, {"Gendc Mode": False})
-    converter.convert_to_video(["./output"], False,[1.0], [1.0], [1.0], False)
-# convert_to_img(2, ["./output","./output"], 640, 480, extension='jpg', pixel_format="BayerBG8")
+    # export all or part of a recording, e.g. the first 5 s of one camera:
+    # python3 convert.py output/group0/camera0 --pixel-format Mono12 --width 1920 --height 1080 --time 0 5
+    parser = argparse.ArgumentParser(description="Convert saved bin files")
+    parser.add_argument('directories', nargs='+', type=str, help='Camera directories, one per device')
+    parser.add_argument('-x', '--extension', default='mp4', type=str, help='mp4, png, jpg, jpeg, bmp or raw')
+    parser.add_argument('--pixel-format', default='Mono12', type=str, help='PixelFormat of the recording')
+    parser.add_argument('--width', default=1920, type=int, help='Width of the recording')
+    parser.add_argument('--height', default=1080, type=int, help='Height of the recording')
+    parser.add_argument('--frame-rate', default=60.0, type=float, help='FrameRate of the recording')
+    parser.add_argument('--payload-size', nargs='+', type=int,
+                        help='PayloadSize of each device, required for GenDC recordings')
+    parser.add_argument('--gendc', action=argparse.BooleanOptionalAction, default=False,
+                        help='The recording was saved in GenDC mode')
+    parser.add_argument('--color-pattern', default='BGGR', type=str, help='Bayer pattern of Bayer recordings')
+    parser.add_argument('--frames', nargs=2, type=int, metavar=('FIRST', 'LAST'),
+                        help='Export only frame ids FIRST to LAST')
+    parser.add_argument('--time', nargs=2, type=float, metavar=('START', 'END'),
+                        help='Export only START to END seconds from the first frame')
+    parser.add_argument('--every', default=1, type=int, help='Export only every Nth selected frame')
+    parser.add_argument('-cw', '--conversion-workers', default=0, type=int,
+                        help='Worker processes used for image conversion, 0 uses one per CPU')
+    parser.add_argument('-cb', '--conversion-batch-size', default=32, type=int,
+                        help='16 bit mono frames processed together for jpg, jpeg and bmp')
+    parser.add_argument('--image-encoder', default='pil', choices=['pil', 'cv2'],
+                        help='Library encoding png/jpg/bmp files')
+    parser.add_argument('--png-compression', default=6, type=int, help='PNG compression level, 0 ~ 9')
+    parser.add_argument('--jpeg-quality', default=75, type=int, help='JPEG quality, 0 ~ 100')
+    parser.add_argument('-et', '--encoding-threads', default=1, type=int,
+                        help='Threads encoding image files in each conversion process')
+    parser.add_argument('--pack', action=argparse.BooleanOptionalAction, default=False,
+                        help='Pack the image-mode bin files into a compressed recording.pack instead of converting')
+    parser.add_argument('--unpack', action=argparse.BooleanOptionalAction, default=False,
+                        help='Restore the image-mode bin files from recording.pack instead of converting')
+    parser.add_argument('--pack-level', default=1, type=int, help='zlib compression level of --pack, 0 ~ 9')
+    args = parser.parse_args()
+
+    num_device = len(args.directories)
+    payloadsizes = args.payload_size
+    if payloadsizes is None:
+        if args.gendc:
+            parser.error("--payload-size is required for GenDC recordings")
+        payloadsizes = [args.width * args.height * required_bit_depth(args.pixel_format) // 8] * num_device
+    elif len(payloadsizes) == 1:
+        payloadsizes = payloadsizes * num_device
+    converter = Converter({"PayloadSize": payloadsizes,
+                           "Number of Devices": num_device,
+                           "PixelFormat": args.pixel_format,
+                           "Width": args.width,
+                           "Height": args.height,
+                           "FrameRate": args.frame_rate
+                           }, {"Gendc Mode": args.gendc, "Color Pattern": args.color_pattern,
+                               "Conversion Workers": args.conversion_workers,
+                               "Conversion Batch Size": args.conversion_batch_size,
+                               "Image Encoder": args.image_encoder,
+                               "PNG Compression Level": args.png_compression,
+                               "JPEG Quality": args.jpeg_quality,
+                               "Encoding Threads": args.encoding_threads})
+    gains = [1.0] * num_device
+    if (args.pack or args.unpack) and args.gendc:
+        parser.error("--pack and --unpack only support image-mode recordings")
+    if args.pack:
+        converter.pack_recording(args.directories, args.pack_level)
+    elif args.unpack:
+        converter.unpack_recording(args.directories)
+    elif args.extension == "mp4":
+        converter.convert_to_video(args.directories, args.gendc, gains, gains, gains, to_delete=False,
+                                   frame_range=args.frames, time_range=args.time, frame_step=args.every)
+    else:
+        converter.convert_to_img(args.directories, args.gendc, args.extension, gains, gains, gains, to_delete=False,
+                                 frame_range=args.frames, time_range=args.time, frame_step=args.every)
@@ -12,10 +12,12 @@ import threading
 from camera_calibration_tool import Display, FrameCapture
 from utils import set_commandline_options, get_device_info, log_write
 import time
-from convert import Converter
+from convert import Converter, ConversionQueue
 
 IPAD_X = 10
 IPAD_Y = 10
+JOB_REFRESH_MS = 200
+MAX_JOB_ROWS = 5
 
 
 class U3VCameraGUI:
@@ -29,6 +31,7 @@ class U3VCameraGUI:
         self.display = Display(dev_info, test_info)
         self.capture = FrameCapture(dev_info, test_info)
         self.converter = Converter(dev_info, test_info)
+        self.conversion_queue = ConversionQueue(self.converter, max(1, test_info["Conversion Jobs"]))
 
         # initialize the sub window and image panel
         self.master = master
@@ -166,8 +169,16 @@ class U3VCameraGUI:
         # sensor1_folder_entry = ttk.Label(progress_frame, textvariable=save_folder_path1 )
         # sensor1_folder_entry.grid(column=1, row=3, sticky='we', padx=5, pady=2, )
 
+        # background conversions of the latest recordings
+        jobs_frame = ttk.Labelframe(config_frame, text="Conversions")
+        jobs_frame.columnconfigure(0, weight=1)
+        jobs_frame.columnconfigure(1, weight=3)
+        self.jobs_frame = jobs_frame
+        self.job_rows = {}
+
         config_option_frame.pack(fill=BOTH, expand=True)
         progress_frame.pack(fill=BOTH, expand=True)
+        jobs_frame.pack(fill=BOTH, expand=True, padx=5, pady=5)
         config_frame.pack(fill=BOTH, expand=True, )
 
         if self.is_gendc_mode:
@@ -188,15 +199,12 @@ class U3VCameraGUI:
         capture_t = threading.Thread(target=self.capture.run)
         capture_t.start()
         self.thread_pool.append(capture_t)
+        self.thread_pool.extend(self.conversion_queue.workers)
+        self.control_root.after(JOB_REFRESH_MS, self.update_conversion_jobs)
 
-        if self.num_device == 2:
-            display_t = threading.Thread(target=self.display.run,
-                                         args=(self.master, self.roots[0], self.display_frames[0], self.roots[1],
-                                               self.display_frames[1]))
-        else:
-            display_t = threading.Thread(target=self.display.run,
-                                         args=(self.master, self.roots[0], self.display_frames[0]))
-
+        # the display thread only prepares frames, the panels are painted here on the Tk main loop
+        self.display.start_rendering(self.master, self.roots, self.display_frames)
+        display_t = threading.Thread(target=self.display.run)
         display_t.start()
         self.thread_pool.append(display_t)
 
@@ -277,9 +285,27 @@ class U3VCameraGUI:
         self.save_btn.configure(state='normal')
         self.save_btn.config(text='start saving')
 
-    def converting_state_on_button(self):
-        self.save_btn.configure(state='disabled')
-        self.save_btn.config(text='Converting')
+    def update_conversion_jobs(self):
+        # on the Tk thread: one row per background conversion, name, progress and status
+        jobs = self.conversion_queue.jobs[-MAX_JOB_ROWS:]
+        for job in list(self.job_rows):
+            if job not in jobs:
+                for widget in self.job_rows.pop(job):
+                    widget.destroy()
+        for row, job in enumerate(jobs):
+            if job not in self.job_rows:
+                self.job_rows[job] = (ttk.Label(self.jobs_frame, text="{} ({})".format(job.name, job.extension)),
+                                      ttk.Progressbar(self.jobs_frame, mode="determinate", orient='horizontal',
+                                                      maximum=100, value=0, length=300),
+                                      ttk.Label(self.jobs_frame, width=10))
+            name_label, progress_bar, status_label = self.job_rows[job]
+            name_label.grid(column=0, row=row, sticky='e', padx=5, pady=2)
+            progress_bar.grid(column=1, row=row, sticky='we', padx=5, pady=2)
+            progress_bar['value'] = 100 * job.progress
+            status_label.configure(text=job.status)
+            status_label.grid(column=2, row=row, sticky='w', padx=5, pady=2)
+        if not self.quit:
+            self.control_root.after(JOB_REFRESH_MS, self.update_conversion_jobs)
 
     def onSave(self, folderPath):
         # save either gendc or image
@@ -309,19 +335,10 @@ class U3VCameraGUI:
                 self.display.is_redirected = True  # saving -> display
 
                 self.progressBar['value'] = 100
-                self.master.after(0, self.converting_state_on_button)
-                if extension == "mp4":
-                    self.converter.convert_to_video(self.capture.output_directories, self.is_gendc_mode,
-                                                    r_gains=self.display.r_gains,
-                                                    g_gains=self.display.g_gains,
-                                                    b_gains=self.display.b_gains,
-                                                    to_delete=self.delete_bin.get())
-                elif extension != "bin":
-                    self.converter.convert_to_img(self.capture.output_directories, self.is_gendc_mode,
-                                                  r_gains=self.display.r_gains,
-                                                  g_gains=self.display.g_gains,
-                                                  b_gains=self.display.b_gains,
-                                                  extension=extension, to_delete=self.delete_bin.get())
+                # converted in the background, the next recording can start right away
+                self.conversion_queue.submit(take_name, output_directories, is_gendc, extension,
+                                             self.display.r_gains, self.display.g_gains, self.display.b_gains,
+                                             to_delete=self.delete_bin.get())
             except Exception as e:
                 print(e)
             finally:
@@ -344,12 +361,19 @@ class U3VCameraGUI:
                                         message="Please input int value in the input time duration entry")
                 return
 
+            # a new directory for every recording, the previous one may still be converting
+            take_name, n = current_time, 1
+            while os.path.exists(os.path.join(folder, take_name)):
+                take_name = "{}-{}".format(current_time, n)
+                n += 1
             for i in range(self.num_device):
-                save_directory = os.path.join(folder, current_time, "group0", "camera" + str(i))
+                save_directory = os.path.join(folder, take_name, "group0", "camera" + str(i))
                 self.capture.output_directories[i] = save_directory
-                self.save_folder_path.set(os.path.join(folder, current_time))
+                self.save_folder_path.set(os.path.join(folder, take_name))
                 if not os.path.isdir(save_directory):
                     os.makedirs(save_directory)
+            output_directories = list(self.capture.output_directories)
+            is_gendc = self.is_gendc_mode
 
             extension = self.combo.get()
             self.capture.start_save = True
@@ -398,9 +422,11 @@ class U3VCameraGUI:
                 "r_gains": self.display.r_gains,
                 "g_gains": self.display.g_gains,
                 "b_gains": self.display.b_gains,
+                "window_level": [self.display.level_min, self.display.level_max],
                 "gendc_mode": self.is_gendc_mode,
                 "delete_bin": self.delete_bin.get(),
                 "winfos": winfos,
+                "max_preview_rate": self.display.test_info["Max Preview Rate"],
 ####################        ADDITIONAL INFORMATION         ###########################
                 "exposuretime max":  self.exposuretime_max,
                 "fps": self.fps,
@@ -422,6 +448,7 @@ class U3VCameraGUI:
         self.capture.stop = True
         self.display.stop = True
         self.quit = True
+        self.conversion_queue.close()
         save_json()
         threading.Thread(target=check).start()
 
@@ -0,0 +1,164 @@
+# converter benchmarks on synthetic recordings, no camera is needed:
+# python3 tests/benchmark_convert.py --gendc-reader
+# python3 tests/benchmark_convert.py --batch
+# python3 tests/benchmark_convert.py --pack
+import argparse
+import functools
+import os
+import struct
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from convert import PACKED_RECORDING_NAME, BinFrameReader, GenDCFrameReader, PackedRecordingReader
+from recordings import gendc_frame, make_converter, make_recording
+from utils import GDC_INTENSITY, log_write
+from gendc_python.gendc_separator import descriptor as gendc
+
+
+def benchmark_gendc_reader(frame_counts, width=640, height=480):
+    # ms to scan a GenDC bin file: a container over the rest of the file copied per frame against GenDCFrameReader
+    pixels = np.random.default_rng(0).integers(0, 4096, (height, width)).astype(np.uint16)
+    payload_in_byte = len(gendc_frame(0, pixels))
+    with tempfile.TemporaryDirectory() as output_directory:
+        for num_frames in frame_counts:
+            file_path = os.path.join(output_directory, "gendc0-{}.bin".format(num_frames))
+            with open(file_path, "wb") as f:
+                for frame_id in range(num_frames):
+                    f.write(gendc_frame(frame_id, pixels))
+            start = time.perf_counter()
+            with open(file_path, mode="rb") as f:
+                filecontent = f.read()
+            cursor = 0
+            while cursor < len(filecontent):
+                gendc_container = gendc.Container(filecontent[cursor:])
+                image_component = gendc_container.get_component_by_index(
+                    gendc_container.get_1st_component_idx_by_typeid(GDC_INTENSITY))
+                image_component.get_part_by_index(0).get_data()
+                cursor += payload_in_byte
+            copy_ms = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            with GenDCFrameReader(file_path, payload_in_byte) as reader:
+                for frame_id, image_component, data in reader.frames():
+                    pass
+            reader_ms = (time.perf_counter() - start) * 1000
+            log_write("INFO", "{} frames {}x{}: copied container {:.1f} ms, GenDCFrameReader {:.1f} ms".format(
+                num_frames, width, height, copy_ms, reader_ms))
+
+
+def best_ms_per_frame(run, num_frames, repeat=5):
+    # fastest of repeat runs, the others are disturbed by the rest of the machine
+    timings = []
+    for k in range(repeat):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000 / num_frames
+
+
+def benchmark_batch(sizes, num_frames=60, batch_size=32):
+    # ms/frame of the Mono12 processing without encoding: the frame by frame path the batches replaced (a
+    # np.memmap per file, multiply, shift, astype) against the converter's batch size and a forced batch size
+    for width, height in sizes:
+        with tempfile.TemporaryDirectory() as root:
+            output_directories, frames = make_recording(root, "Mono12", width, height, num_files=1,
+                                                        frames_per_file=num_frames)
+            file_path = os.path.join(output_directories[0], "image0-0.bin")
+            converter = make_converter("Mono12", width, height, **{"Conversion Batch Size": batch_size})
+            with BinFrameReader(file_path, height, width, 16) as reader:
+                records = np.memmap(file_path, dtype=reader.dtype, mode="r")
+                for extension in ("jpg", "png"):
+                    to_8bit = extension == "jpg"
+
+                    def process_frames():
+                        for idx in range(num_frames):
+                            img_arr = records[idx]["pixels"] * 16
+                            if to_8bit:
+                                img_arr = (img_arr >> 8).astype(np.uint8)
+
+                    def process_batches(size):
+                        for frame_ids, img_stack in reader.batches(batch_size=size):
+                            converter.process_batch(img_stack, 4, to_8bit=to_8bit)
+
+                    process_frames()  # page cache
+                    results = ["previous {:.3f}".format(best_ms_per_frame(process_frames, num_frames))]
+                    size = converter.get_batch_size(False, height, width, 16, extension)
+                    for name, size in (("converter (batch {})".format(size), size),
+                                       ("batch {}".format(batch_size), batch_size)):
+                        results.append("{} {:.3f}".format(name, best_ms_per_frame(
+                            functools.partial(process_batches, size), num_frames)))
+                    log_write("INFO", "Mono12 -> {} {}x{} ms/frame: {}".format(extension, width, height,
+                                                                             ", ".join(results)))
+                del records
+
+def write_smooth_recording(file_path, bits, width, height, num_frames, seed=0):
+    # image-mode bin file of a moving smooth image with 0 ~ 47 levels of sensor noise
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    with open(file_path, "wb") as f:
+        for frame_id in range(num_frames):
+            image = (np.sin((x + 4 * frame_id) / 97) * np.cos(y / 61) + 1) * (1 << (bits - 2))
+            noise = rng.integers(0, 48, (height, width))
+            pixels = np.clip(image + noise, 0, (1 << bits) - 1).astype(np.uint16)
+            f.write(struct.pack("<I", frame_id))
+            f.write(pixels.tobytes())
+
+
+def benchmark_pack(width=1920, height=1080, num_frames=60):
+    # size, pack and read speed of recording.pack against the image-mode bin file
+    for pixelformat, compression_level in (("Mono12", 1), ("Mono12", 6), ("Mono10", 1)):
+        with tempfile.TemporaryDirectory() as output_directory:
+            bits = 12 if pixelformat == "Mono12" else 10
+            file_path = os.path.join(output_directory, "image0-0.bin")
+            write_smooth_recording(file_path, bits, width, height, num_frames)
+            raw_mb = os.path.getsize(file_path) / 1e6
+            converter = make_converter(pixelformat, width, height)
+            start = time.perf_counter()
+            converter.pack_recording([output_directory], compression_level)
+            pack_s = time.perf_counter() - start
+            pack_path = os.path.join(output_directory, "image0-" + PACKED_RECORDING_NAME)
+            packed_mb = os.path.getsize(pack_path) / 1e6
+            start = time.perf_counter()
+            with PackedRecordingReader(pack_path) as reader:
+                for frame_ids, file_numbers, img_stack in reader.batches():
+                    pass
+            read_s = time.perf_counter() - start
+            start = time.perf_counter()
+            with PackedRecordingReader(pack_path) as reader:
+                reader[num_frames // 2]
+            random_ms = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            with BinFrameReader(file_path, height, width, 16) as reader:
+                for frame_ids, img_stack in reader.batches(batch_size=8):
+                    img_stack.copy()
+            bin_read_s = time.perf_counter() - start
+            log_write("INFO", "{} zlib {} {} frames {}x{}: {:.0f} MB -> {:.0f} MB ({:.0%}), pack {:.0f} MB/s, "
+                              "read {:.0f} MB/s, random frame {:.0f} ms, bin file read {:.0f} MB/s".format(
+                                  pixelformat, compression_level, num_frames, width, height, raw_mb, packed_mb,
+                                  packed_mb / raw_mb, raw_mb / pack_s, raw_mb / read_s, random_ms,
+                                  raw_mb / bin_read_s))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Converter benchmarks")
+    parser.add_argument('--gendc-reader', action=argparse.BooleanOptionalAction, default=False,
+                        help='Measure scanning GenDC bin files of 60, 120 and 240 frames of 640x480')
+    parser.add_argument('--frames', nargs='+', default=[60, 120, 240], type=int,
+                        help='Frames per GenDC bin file of --gendc-reader')
+    parser.add_argument('--batch', action=argparse.BooleanOptionalAction, default=False,
+                        help='Measure processing Mono12 frames one by one and in batches at 640x480 and 1920x1080')
+    parser.add_argument('--pack', action=argparse.BooleanOptionalAction, default=False,
+                        help='Measure the size and speed of recording.pack for 60 Mono10/Mono12 frames of 1920x1080')
+    args = parser.parse_args()
+    if args.gendc_reader:
+        benchmark_gendc_reader(args.frames)
+    if args.batch:
+        benchmark_batch([(640, 480), (1920, 1080)])
+    if args.pack:
+        benchmark_pack()
+    if not (args.gendc_reader or args.batch or args.pack):
+        parser.print_help()
@@ -0,0 +1,51 @@
+# preview painting benchmark, needs a display:
+# python3 tests/benchmark_preview.py
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+from PIL import ImageTk
+import tkinter as tk
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from camera_calibration_tool import PreviewSurface
+from utils import log_write
+
+
+def benchmark_preview(sizes, num_frames=200):
+    # frames/s of painting a preview panel: a new PhotoImage per frame against PreviewSurface.paste
+    root = tk.Tk()
+    panel = tk.Label(root)
+    panel.pack()
+    rng = np.random.default_rng(0)
+    for width, height in sizes:
+        for channels in (1, 3):
+            shape = (height, width) if channels == 1 else (height, width, channels)
+            frames = [rng.integers(0, 256, shape, dtype=np.uint8) for _ in range(2)]
+            start = time.perf_counter()
+            for k in range(num_frames):
+                image = ImageTk.PhotoImage(Image.fromarray(frames[k % 2]))
+                panel.configure(image=image)
+                panel.image = image
+                root.update_idletasks()
+            new_image_fps = num_frames / (time.perf_counter() - start)
+            surface = PreviewSurface(panel)
+            start = time.perf_counter()
+            for k in range(num_frames):
+                surface.paint(frames[k % 2])
+                root.update_idletasks()
+            paste_fps = num_frames / (time.perf_counter() - start)
+            log_write("INFO", "{}x{}x{}: new PhotoImage {:.1f} fps, paste {:.1f} fps".format(
+                width, height, channels, new_image_fps, paste_fps))
+    root.destroy()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Preview benchmark")
+    parser.add_argument('--frames', default=200, type=int, help='Frames painted per measurement')
+    args = parser.parse_args()
+    benchmark_preview([(640, 480), (1920, 1080)], args.frames)
@@ -0,0 +1,81 @@
+# synthetic recordings in the layout the record graph writes: group0/cameraN/<prefix><n>.bin + <prefix>config.json
+import json
+import os
+import struct
+
+import numpy as np
+
+from convert import Converter, get_bin_prefix
+from utils import get_bit_width, required_bit_depth
+
+GENDC_DESCRIPTOR_SIZE = 184  # container header + one component header + one intensity part header
+
+
+def gendc_frame(frame_id, pixels, timestamp=0):
+    # one GenDC container with a single intensity component holding pixels
+    data = pixels.tobytes()
+    buffer = bytearray(GENDC_DESCRIPTOR_SIZE + len(data))
+    # container header: signature, version, type, flags, header size, ..., data size, data offset, descriptor size
+    struct.pack_into("<4s3sBHHIQH6sQQII", buffer, 0, b"GNDC", b"\x00\x00\x01", 0, 0x1000, 0, 64, 0, 0, b"\0" * 6,
+                     len(data), GENDC_DESCRIPTOR_SIZE, GENDC_DESCRIPTOR_SIZE, 1)
+    struct.pack_into("<Q", buffer, 56, 64)  # offset of the component header
+    # component header: intensity, timestamp, one part
+    struct.pack_into("<HHIHHHHIIQQIHH", buffer, 64, 0x2000, 0, 56, 0, 0, 0, 0, 0, 0, timestamp, 1, 0, 0, 1)
+    struct.pack_into("<Q", buffer, 64 + 48, 120)  # offset of the part header
+    # 2D part header: data size, data offset, width and height, frame id in the type specific info
+    height, width = pixels.shape
+    struct.pack_into("<HHIIHHQQQQQQ", buffer, 120, 0x4200, 0, 64, 0, 0, 0, 0, len(data), GENDC_DESCRIPTOR_SIZE,
+                     width | (height << 32), 0, frame_id)
+    buffer[GENDC_DESCRIPTOR_SIZE:] = data
+    return bytes(buffer)
+
+
+def make_recording(root, pixelformat, width, height, is_gendc=False, num_device=1, num_files=2, frames_per_file=5,
+                   seed=0):
+    # returns the camera directories and the pixels of every frame by frame id, per device
+    rng = np.random.default_rng(seed)
+    dtype = np.uint8 if required_bit_depth(pixelformat) == 8 else np.uint16
+    output_directories, frames = [], []
+    for i in range(num_device):
+        output_directory = os.path.join(root, "group0", "camera{}".format(i))
+        os.makedirs(output_directory)
+        prefix = get_bin_prefix(is_gendc, i)
+        pixels_by_id = {}
+        frame_id = 0
+        for n in range(num_files):
+            with open(os.path.join(output_directory, "{}{}.bin".format(prefix, n)), "wb") as f:
+                for k in range(frames_per_file):
+                    pixels = rng.integers(0, 1 << get_bit_width(pixelformat), (height, width)).astype(dtype)
+                    if is_gendc:
+                        f.write(gendc_frame(frame_id, pixels, timestamp=frame_id * 1000000))
+                    else:
+                        f.write(struct.pack("<I", frame_id))
+                        f.write(pixels.tobytes())
+                    pixels_by_id[frame_id] = pixels
+                    frame_id += 1
+        with open(os.path.join(output_directory, prefix + "config.json"), "w") as f:
+            json.dump({"group_id": 0}, f)
+        output_directories.append(output_directory)
+        frames.append(pixels_by_id)
+    return output_directories, frames
+
+
+def make_converter(pixelformat, width, height, is_gendc=False, num_device=1, color_pattern="BGGR", **test_info):
+    payloadsize = width * height * required_bit_depth(pixelformat) // 8
+    if is_gendc:
+        payloadsize += GENDC_DESCRIPTOR_SIZE
+    dev_info = {"PayloadSize": [payloadsize] * num_device,
+                "Number of Devices": num_device,
+                "PixelFormat": pixelformat,
+                "Width": width,
+                "Height": height,
+                "FrameRate": 10.0}
+    info = {"Gendc Mode": is_gendc, "Color Pattern": color_pattern,
+            "Conversion Workers": 1,
+            "Conversion Batch Size": 32,
+            "Image Encoder": "pil",
+            "PNG Compression Level": 1,
+            "JPEG Quality": 75,
+            "Encoding Threads": 1}
+    info.update(test_info)
+    return Converter(dev_info, info)
@@ -0,0 +1,232 @@
+# golden output of the converter: every saved frame against a reference computed straight from the bin pixels
+import io
+import os
+import time
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from convert import FRAME_INDEX_NAME, PACKED_RECORDING_NAME, ConversionQueue, PackedRecordingReader, \
+    get_bin_prefix, load_frame_index
+from recordings import make_converter, make_recording
+from utils import get_num_bit_shift, required_bit_depth
+
+WIDTH, HEIGHT = 16, 12
+PIXELFORMATS = ["Mono8", "Mono12", "BayerBG8", "BayerRG12"]
+COLOR_PATTERNS = {"BayerBG8": "BGGR", "BayerRG12": "RGGB"}
+DEMOSAIC_CODES = {"BGGR": cv2.COLOR_BayerBGGR2RGB, "RGGB": cv2.COLOR_BayerRGGB2RGB}
+GAINS = (1.5, 1.0, 0.75)  # r, g, b
+
+
+def reference_image(pixels, pixelformat, extension, gains=GAINS):
+    # what the converter must save for one frame of the bin file
+    if extension == "raw":
+        return pixels
+    depth = required_bit_depth(pixelformat)
+    full_scale = (pixels.astype(np.uint32) << get_num_bit_shift(pixelformat)).astype(pixels.dtype)
+    if depth == 16 and extension not in ("png", "mp4"):
+        # 8 bit formats: reduced before the demosaic
+        full_scale = (full_scale >> 8).astype(np.uint8)
+        depth = 8
+    if pixelformat not in COLOR_PATTERNS:
+        return full_scale
+    rgb = cv2.cvtColor(full_scale, DEMOSAIC_CODES[COLOR_PATTERNS[pixelformat]])
+    scale = rgb.astype(np.float32) / np.float32(pow(2, depth) - 1)
+    return np.stack([((scale[..., c] * np.float32(gains[c])).clip(0, 1) * 255).astype(np.uint8)
+                     for c in range(3)], axis=-1)
+
+
+def load_image(file_path, extension, pixelformat):
+    if extension == "raw":
+        dtype = np.uint8 if required_bit_depth(pixelformat) == 8 else np.uint16
+        return np.fromfile(file_path, dtype=dtype).reshape(HEIGHT, WIDTH)
+    return np.asarray(Image.open(file_path))
+
+
+def jpeg_round_trip(img_arr):
+    # jpg is lossy, the reference goes through the same encoder at the same quality
+    buffer = io.BytesIO()
+    Image.fromarray(img_arr).save(buffer, format="jpeg", quality=75)
+    return np.asarray(Image.open(buffer))
+
+
+def convert(tmp_path, pixelformat, is_gendc, extension, num_device=1, **kwargs):
+    output_directories, frames = make_recording(str(tmp_path), pixelformat, WIDTH, HEIGHT, is_gendc, num_device)
+    converter = make_converter(pixelformat, WIDTH, HEIGHT, is_gendc, num_device,
+                               color_pattern=COLOR_PATTERNS.get(pixelformat, "BGGR"))
+    gains = [[gain] * num_device for gain in GAINS]
+    if extension == "mp4":
+        succeeded = converter.convert_to_video(output_directories, is_gendc, *gains, **kwargs)
+    else:
+        succeeded = converter.convert_to_img(output_directories, is_gendc, extension, *gains, **kwargs)
+    return succeeded, output_directories, frames
+
+
+@pytest.mark.parametrize("extension", ["png", "jpg", "raw"])
+@pytest.mark.parametrize("is_gendc", [False, True])
+@pytest.mark.parametrize("pixelformat", PIXELFORMATS)
+def test_convert_to_img(tmp_path, pixelformat, is_gendc, extension):
+    succeeded, output_directories, frames = convert(tmp_path, pixelformat, is_gendc, extension, to_delete=False)
+    assert succeeded
+    saved = sorted(f for f in os.listdir(output_directories[0]) if f.endswith("." + extension))
+    assert saved == sorted("{}.{}".format(frame_id, extension) for frame_id in frames[0])
+    for frame_id, pixels in frames[0].items():
+        expected = reference_image(pixels, pixelformat, extension)
+        if extension == "jpg":
+            expected = jpeg_round_trip(expected)
+        img_arr = load_image(os.path.join(output_directories[0], "{}.{}".format(frame_id, extension)), extension,
+                             pixelformat)
+        assert img_arr.shape == expected.shape
+        np.testing.assert_array_equal(img_arr.astype(np.uint32), expected.astype(np.uint32))
+
+
+@pytest.mark.parametrize("is_gendc", [False, True])
+def test_convert_to_img_two_devices(tmp_path, is_gendc):
+    succeeded, output_directories, frames = convert(tmp_path, "Mono12", is_gendc, "png", num_device=2,
+                                                    to_delete=False)
+    assert succeeded
+    for output_directory, pixels_by_id in zip(output_directories, frames):
+        for frame_id, pixels in pixels_by_id.items():
+            img_arr = load_image(os.path.join(output_directory, "{}.png".format(frame_id)), "png", "Mono12")
+            np.testing.assert_array_equal(img_arr.astype(np.uint32),
+                                          reference_image(pixels, "Mono12", "png").astype(np.uint32))
+
+
+def test_convert_to_img_deletes_converted_recording(tmp_path):
+    succeeded, output_directories, frames = convert(tmp_path, "Mono8", False, "png", to_delete=True)
+    assert succeeded
+    remaining = os.listdir(output_directories[0])
+    assert not [f for f in remaining if f.endswith(".bin")]
+    assert get_bin_prefix(False, 0) + FRAME_INDEX_NAME not in remaining
+    assert len([f for f in remaining if f.endswith(".png")]) == len(frames[0])
+
+
+@pytest.mark.parametrize("is_gendc", [False, True])
+def test_convert_to_img_partial_export(tmp_path, is_gendc):
+    succeeded, output_directories, frames = convert(tmp_path, "Mono8", is_gendc, "png", to_delete=True,
+                                                    frame_range=(2, 8), frame_step=2)
+    assert succeeded
+    remaining = os.listdir(output_directories[0])
+    assert sorted(f for f in remaining if f.endswith(".png")) == ["2.png", "4.png", "6.png", "8.png"]
+    # a partial export keeps the recording
+    assert len([f for f in remaining if f.endswith(".bin")]) == 2
+
+
+def test_convert_to_img_keeps_recording_when_a_frame_is_not_saved(tmp_path):
+    output_directories, frames = make_recording(str(tmp_path), "Mono8", WIDTH, HEIGHT)
+    # the encoder can't write 3.jpg
+    os.makedirs(os.path.join(output_directories[0], "3.jpg"))
+    converter = make_converter("Mono8", WIDTH, HEIGHT)
+    assert not converter.convert_to_img(output_directories, False, "jpg", [1.0], [1.0], [1.0], to_delete=True)
+    remaining = os.listdir(output_directories[0])
+    assert "image0-0.bin" in remaining
+    assert "image0-1.bin" not in remaining
+
+
+@pytest.mark.parametrize("is_gendc", [False, True])
+@pytest.mark.parametrize("pixelformat", PIXELFORMATS)
+def test_convert_to_video(tmp_path, pixelformat, is_gendc):
+    succeeded, output_directories, frames = convert(tmp_path, pixelformat, is_gendc, "mp4", to_delete=False)
+    assert succeeded
+    capture = cv2.VideoCapture(os.path.join(output_directories[0], "output.mp4"))
+    try:
+        num_frames = 0
+        while True:
+            read, img_arr = capture.read()
+            if not read:
+                break
+            assert img_arr.shape[:2] == (HEIGHT, WIDTH)
+            num_frames += 1
+    finally:
+        capture.release()
+    assert num_frames == len(frames[0])
+
+
+def test_convert_to_video_keeps_recording_when_a_bin_file_cannot_be_read(tmp_path):
+    output_directories, frames = make_recording(str(tmp_path), "Mono8", WIDTH, HEIGHT)
+    converter = make_converter("Mono8", WIDTH, HEIGHT)
+    converter.get_frame_indices(output_directories, False)
+    # indexed, but opening image0-1.bin raises IsADirectoryError
+    os.remove(os.path.join(output_directories[0], "image0-1.bin"))
+    os.makedirs(os.path.join(output_directories[0], "image0-1.bin"))
+    assert not converter.convert_to_video(output_directories, False, [1.0], [1.0], [1.0], to_delete=True)
+    remaining = os.listdir(output_directories[0])
+    assert "image0-0.bin" in remaining
+    assert get_bin_prefix(False, 0) + FRAME_INDEX_NAME in remaining
+
+
+def test_frame_index_is_not_left_mapped(tmp_path):
+    # a mapped index can't be deleted or have its directory moved on Windows
+    output_directories, frames = make_recording(str(tmp_path), "Mono8", WIDTH, HEIGHT)
+    converter = make_converter("Mono8", WIDTH, HEIGHT)
+    converter.get_frame_indices(output_directories, False)
+    frame_index = load_frame_index(output_directories[0], get_bin_prefix(False, 0))
+    assert len(frame_index) == len(frames[0])
+    assert not isinstance(frame_index, np.memmap)
+
+
+def set_pixel(file_path, frame_position, pixelformat, value):
+    # overwrites the first pixel of the frame_position-th frame of an image-mode bin file
+    bytes_per_pixel = required_bit_depth(pixelformat) // 8
+    with open(file_path, "r+b") as f:
+        f.seek(frame_position * (4 + WIDTH * HEIGHT * bytes_per_pixel) + 4)
+        f.write(value.to_bytes(bytes_per_pixel, "little"))
+
+
+@pytest.mark.parametrize("width, height", [(WIDTH, HEIGHT), (13, 7)])
+@pytest.mark.parametrize("pixelformat", ["Mono8", "Mono10", "Mono12"])
+def test_pack_recording_round_trip(tmp_path, pixelformat, width, height):
+    output_directories, frames = make_recording(str(tmp_path), pixelformat, width, height)
+    bin_paths = [os.path.join(output_directories[0], "image0-{}.bin".format(n)) for n in range(2)]
+    recording = [open(file_path, "rb").read() for file_path in bin_paths]
+    converter = make_converter(pixelformat, width, height)
+    converter.pack_recording(output_directories, to_delete=True)
+    assert not [f for f in os.listdir(output_directories[0]) if f.endswith(".bin")]
+    pack_path = os.path.join(output_directories[0], get_bin_prefix(False, 0) + PACKED_RECORDING_NAME)
+    with PackedRecordingReader(pack_path) as reader:
+        assert len(reader) == len(frames[0])
+        for idx in (7, 0, 9, 8):
+            frame_id, pixels = reader[idx]
+            np.testing.assert_array_equal(pixels, frames[0][frame_id])
+    converter.unpack_recording(output_directories, to_delete=True)
+    assert [open(file_path, "rb").read() for file_path in bin_paths] == recording
+    assert not os.path.exists(pack_path)
+
+
+def test_pack_recording_keeps_pixels_above_the_sensor_bit_width(tmp_path):
+    # a chunk with such a pixel is stored with every 16 bits, the other chunks bit packed
+    output_directories, frames = make_recording(str(tmp_path), "Mono12", WIDTH, HEIGHT)
+    bin_path = os.path.join(output_directories[0], "image0-1.bin")
+    set_pixel(bin_path, 4, "Mono12", 0xFFFF)  # frame 9, in the second chunk
+    recording = open(bin_path, "rb").read()
+    converter = make_converter("Mono12", WIDTH, HEIGHT)
+    converter.pack_recording(output_directories, to_delete=True)
+    pack_path = os.path.join(output_directories[0], get_bin_prefix(False, 0) + PACKED_RECORDING_NAME)
+    with PackedRecordingReader(pack_path) as reader:
+        assert reader.chunks["bits"].tolist() == [12, 16]
+        assert reader[9][1][0, 0] == 0xFFFF
+    converter.unpack_recording(output_directories)
+    assert open(bin_path, "rb").read() == recording
+
+
+@pytest.mark.parametrize("extension", ["mp4", "png"])
+def test_conversion_queue(tmp_path, extension):
+    output_directories, frames = make_recording(str(tmp_path), "Mono12", WIDTH, HEIGHT)
+    conversion_queue = ConversionQueue(make_converter("Mono12", WIDTH, HEIGHT), niceness=0)
+    try:
+        job = conversion_queue.submit("take", output_directories, False, extension, [1.0], [1.0], [1.0], True)
+        deadline = time.time() + 60
+        while job.status in ("queued", "converting") and time.time() < deadline:
+            time.sleep(0.1)
+    finally:
+        conversion_queue.close()
+    assert job.status == "done"
+    assert job.device_progress == {0: 1.0}
+    remaining = os.listdir(output_directories[0])
+    assert not [f for f in remaining if f.endswith(".bin")]
+    if extension == "mp4":
+        assert "output.mp4" in remaining
+    else:
+        assert len([f for f in remaining if f.endswith(".png")]) == len(frames[0])
@@ -3,12 +3,15 @@ import json
 import os
 import datetime
 import argparse
+import struct
 import sys
 from pathlib import Path
 
 import os
 
+import numpy as np
 from aravis import Aravis
+from gendc_python.gendc_separator import descriptor as gendc
 
 DEFAULT_PREFIX_NAME0 = "image0-"
 DEFAULT_PREFIX_NAME1 = "image1-"
@@ -19,6 +22,11 @@ DEFAULT_GENDC_PREFIX_NAME1 = "gendc1-"
 IPAD_X = 10
 IPAD_Y = 10
 
+GDC_INTENSITY = 1
+
+DEFAULT_PREVIEW_RATE = 30.0  # Hz
+MIN_PREVIEW_RATE = 0.1  # Hz, a rate saved in default.json is clamped to at least this
+
 pfnc = {
     "Mono8": {"value": 0x01080001, "depth": 8, "dim": 2},
     "Mono10": {"value": 0x01100003, "depth": 10, "dim": 2},
@@ -32,6 +40,35 @@ pfnc = {
     "BayerRG12": {"value": 0x01100013, "depth": 12, "dim": 2},
 }
 
+class ParamStore(list):
+    # list of per-device parameter values that remembers which entries changed
+    def __init__(self, values):
+        super().__init__(values)
+        self.dirty = [False] * len(self)
+
+    def __setitem__(self, idx, value):
+        if self[idx] != value:
+            super().__setitem__(idx, value)
+            self.dirty[idx] = True
+
+    def take_dirty(self):
+        # indices changed since the last call; the flag is cleared before the value is read
+        changed = []
+        for i in range(len(self)):
+            if self.dirty[i]:
+                self.dirty[i] = False
+                changed.append(i)
+        return changed
+
+
+def positive_float(value):
+    # argparse type of options that must be greater than 0
+    value = float(value)
+    if not value > 0:
+        raise argparse.ArgumentTypeError("{} is not a positive number".format(value))
+    return value
+
+
 def set_commandline_options():
     parser = argparse.ArgumentParser(description="U3V Camera")
     parser.add_argument('-d', '--directory', default='./output', type=str, help='Directory to save log')
@@ -45,6 +82,27 @@ def set_commandline_options():
                         help='Switch image capture mode(realtime)')
     parser.add_argument('-sync', '--frame-sync-mode', action=argparse.BooleanOptionalAction, default=True,
                         help='Switch image capture mode{synchronized}')
+    parser.add_argument('-pr', '--max-preview-rate', default=None, type=positive_float,
+                        help='Maximum refresh rate of the preview in Hz, '
+                             'default: the rate saved in default.json or {}'.format(DEFAULT_PREVIEW_RATE))
+    parser.add_argument('-pn', '--preview-every', default=1, type=int,
+                        help='Preview only every Nth captured frame')
+    parser.add_argument('--preview-interpolation', default='linear', choices=['linear', 'area'],
+                        help='Interpolation of the scaled down preview, area is smoother but slower')
+    parser.add_argument('--drop-preview-on-record', action=argparse.BooleanOptionalAction, default=False,
+                        help='Freeze the preview while saving')
+    parser.add_argument('-cw', '--conversion-workers', default=0, type=int,
+                        help='Number of processes converting bin files into images, 0 uses all CPUs')
+    parser.add_argument('-cb', '--conversion-batch-size', default=32, type=int,
+                        help='Number of 16 bit mono frames processed together while converting into jpg/jpeg/bmp')
+    parser.add_argument('--image-encoder', default='pil', choices=['pil', 'cv2'],
+                        help='Library encoding png/jpg/bmp files')
+    parser.add_argument('--png-compression', default=6, type=int, help='PNG compression level, 0 ~ 9')
+    parser.add_argument('--jpeg-quality', default=75, type=int, help='JPEG quality, 0 ~ 100')
+    parser.add_argument('-et', '--encoding-threads', default=1, type=int,
+                        help='Number of threads encoding image files in each conversion process')
+    parser.add_argument('-cj', '--conversion-jobs', default=1, type=int,
+                        help='Number of finished recordings converted at the same time in the background')
     parser.add_argument('--sim-mode', action=argparse.BooleanOptionalAction, default=False)
     if '--sim-mode' in sys.argv:
         parser.add_argument('--pixel-format', default='BayerBG8', type=str,
@@ -266,6 +324,28 @@ def get_device_info(parser, load_json_path="default.json"):
 
         Aravis.shutdown()
 
+    if args.max_preview_rate is not None:
+        test_info["Max Preview Rate"] = args.max_preview_rate
+    elif load_json and "max_preview_rate" in setting_config:
+        try:
+            test_info["Max Preview Rate"] = max(MIN_PREVIEW_RATE, float(setting_config["max_preview_rate"]))
+        except (TypeError, ValueError):
+            test_info["Max Preview Rate"] = DEFAULT_PREVIEW_RATE
+        if test_info["Max Preview Rate"] != setting_config["max_preview_rate"]:
+            log_write("WARNING", "max_preview_rate {} in {} is replaced with {}".format(
+                setting_config["max_preview_rate"], load_json_path, test_info["Max Preview Rate"]))
+    else:
+        test_info["Max Preview Rate"] = DEFAULT_PREVIEW_RATE
+    test_info["Preview Every N Frames"] = args.preview_every
+    test_info["Drop Preview While Recording"] = args.drop_preview_on_record
+    test_info["Preview Interpolation"] = args.preview_interpolation
+    test_info["Conversion Workers"] = args.conversion_workers
+    test_info["Conversion Batch Size"] = args.conversion_batch_size
+    test_info["Image Encoder"] = args.image_encoder
+    test_info["PNG Compression Level"] = args.png_compression
+    test_info["JPEG Quality"] = args.jpeg_quality
+    test_info["Encoding Threads"] = args.encoding_threads
+    test_info["Conversion Jobs"] = args.conversion_jobs
     test_info["acquisition-bb"] = get_bb_for_obtain_image(dev_info["Number of Devices"], dev_info["PixelFormat"])
     test_info["Red Gains"] = setting_config["r_gains"] if load_json and "r_gains" in setting_config else [1.0] * \
                                                                                                          dev_info[
@@ -278,6 +358,7 @@ def get_device_info(parser, load_json_path="default.json"):
                                                                                                                "Number of Devices"]
     test_info["Gendc Mode"] = setting_config["gendc_mode"] if load_json and dev_info[
         "GenDCStreamingMode"] and "gendc_mode" in setting_config else False
+    test_info["Window Level"] = setting_config["window_level"] if load_json and "window_level" in setting_config else [None, None]
     test_info["Delete Bins"] = setting_config["delete_bin"] if load_json and "delete_bin" in setting_config else True
     test_info["Window infos"] = setting_config["winfos"] if load_json and "winfos" in setting_config else [dev_info[
                                                                                                                'Width'],
@@ -317,5 +398,41 @@ def get_bit_width(pixelformat):
     return pfnc[pixelformat]["depth"]
 
 
+def get_preview_lut(pixelformat, level_min=None, level_max=None):
+    # uint8 lookup table indexed by the raw buffer value (uint8 or uint16)
+    depth = required_bit_depth(pixelformat)
+    values = np.arange(pow(2, depth), dtype=np.uint32)
+    if level_min is None and level_max is None:
+        # same as (value << num_bit_shift) / 256 on the wrapped buffer type
+        return (((values << get_num_bit_shift(pixelformat)) & (pow(2, depth) - 1)) >> (depth - 8)).astype(np.uint8)
+    # window/level: stretch [level_min, level_max] (in sensor bits) over 0 ~ 255
+    level_min = 0 if level_min is None else int(level_min)
+    level_max = pow(2, get_bit_width(pixelformat)) - 1 if level_max is None else int(level_max)
+    level_max = max(level_max, level_min + 1)
+    values = values.clip(level_min, level_max) - level_min
+    return (values * 255 // (level_max - level_min)).astype(np.uint8)
+
+
+def get_color_lut(depth, gains):
+    # uint8 lookup table per channel, shape (channels, 2 ** depth): value / full scale * gain, clipped to 0 ~ 255
+    values = np.arange(pow(2, depth), dtype=np.float32) / np.float32(pow(2, depth) - 1)
+    return np.stack([((values * np.float32(gain)).clip(0, 1) * 255).astype(np.uint8) for gain in gains])
+
+
 def normalize_to_uint8(pixelformat):
     return (pow(2, 8) - 1) / (pow(2, pfnc[pixelformat]["depth"]) - 1)
+
+
+def get_gendc_image_offset(gendc_buffer):
+    # byte offset of the first intensity part, read from the GenDC descriptor
+    # the parser allocates per component without a bound, so a garbage count is rejected first
+    descriptor_size, component_count = struct.unpack_from("<II", gendc_buffer, 48)
+    if descriptor_size > gendc_buffer.size or 56 + 8 * component_count > descriptor_size:
+        raise ValueError("invalid GenDC descriptor size {} for {} components".format(descriptor_size,
+                                                                                   component_count))
+    container = gendc.Container(memoryview(gendc_buffer))
+    image_component_idx = container.get_1st_component_idx_by_typeid(GDC_INTENSITY)
+    if image_component_idx == -1:
+        return -1
+    part = container.get_component_by_index(image_component_idx).get_part_by_index(0)
+    return part.get_data_offset()